@@ -9,18 +9,33 @@ Dash app for cobweb plot
 """
 
 import os
-import numpy as np
-import pandas as pd
+import io
+import json
+import hashlib
+import argparse
+from functools import lru_cache
 
-import base64
+import numpy as np
 
 import dash
 from dash import dcc
 from dash import html
-from dash.dependencies import Input, Output
+from dash import Patch
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 
-from app_functions import generate_cobweb_trajectory_sigmoid, make_cobweb_fig_sigmoid,\
-    make_restitution_fig_sigmoid, make_apd_sequence
+from tile_store import open_tile_store, panel_settings
+from metrics import instrument_app
+from profiling import profile_callback
+from coalesce import coalesce_callback, request_hook
+from result_cache import open_result_cache, memoize, cache_responses
+from app_functions import restitution_models, generate_cobweb_trajectory_model,\
+    make_cobweb_fig_model, make_restitution_fig_model, make_apd_sequence,\
+    compute_bifurcation_data_model, make_bifurcation_fig, sample_cobweb_map_model,\
+    cobweb_staircase, find_cobweb_cycle_model, classify_cycle,\
+    find_fixed_points_model, fixed_point_markers, compute_regime_map,\
+    make_regime_map_fig, encode_array, encode_figure, downsample_cobweb_trajectory_model,\
+    compute_basins_model, make_basin_fig
 
 
 
@@ -37,6 +52,7 @@ external_scripts = ['https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.4/MathJa
 app = dash.Dash(__name__, 
 				external_stylesheets=external_stylesheets,
                 external_scripts = external_scripts,
+                hooks = {'request_pre': request_hook},
 				)
 
 print('Launching dash')
@@ -55,16 +71,33 @@ server = app.server
 # apdmax=207, alpha=136, tau=78
 
 
-# # Default model parameters
-# apdmax = 216.9 # y0+a
-# alpha = 96.9 # a
-# tau = 96 # 1/b
+# Default model parameters (exponential function)
+apdmax = 216.9 # y0+a
+alpha = 96.9 # a
+tau = 96 # 1/b
 
 # Default model parameters (sigmoid function, from Ravi)
 a = 201.3
 b = 46.6
 x0 = -13.5
 
+# Restitution model shown when the app loads (key of restitution_models)
+model_name = 'sigmoid'
+
+# Names of the parameters of all restitution models, in the order of the
+# slider inputs of the callbacks
+restitution_param_names = ['apdmax', 'alpha', 'tau', 'a', 'b', 'x0']
+
+def get_model_params(model_name, apdmax, alpha, tau, a, b, x0):
+    '''
+    Model for model_name and the tuple of its parameter values
+    '''
+    model = restitution_models[model_name]
+    values = dict(apdmax=apdmax, alpha=alpha, tau=tau, a=a, b=b, x0=x0)
+    return model, tuple(values[name] for name in model.param_names)
+
+model, params = get_model_params(model_name, apdmax, alpha, tau, a, b, x0)
+
 theta = 0
 ts = 300
 
@@ -72,20 +105,32 @@ ts = 300
 apd0 = 150 
 nmax = 40
 
-# Generate cobweb trajectory
-# apd_traj = generate_cobweb_trajectory(nmax, apd0, apdmax, alpha, tau, theta, ts)
-apd_traj = generate_cobweb_trajectory_sigmoid(nmax, apd0, a, b, x0, theta, ts)
-
-
-# Make figures
-# fig_cobweb = make_cobweb_fig(apdmax, alpha, tau, theta, ts, apd_traj)
-# fig_restitution = make_restitution_fig(apdmax, alpha, tau)
-# fig_apd_sequence = make_apd_sequence(apd_traj)
-
-# Make figures (sigmoid)
-fig_cobweb = make_cobweb_fig_sigmoid(a, b, x0, theta, ts, apd_traj)
-fig_restitution = make_restitution_fig_sigmoid(a, b, x0)
-fig_apd_sequence = make_apd_sequence(apd_traj)
+# Number of beats of the long run shown in the APD sequence (0 shows the
+# iterations of the cobweb plot). Long runs are downsampled to the minimum
+# and maximum APD of n_buckets_long_run buckets of beats. They are computed
+# in the callback, so the options stop at 10^6 beats (about 1.5 s when the
+# run never settles on a cycle).
+long_run = 0
+long_run_options = [{'label': 'Cobweb iterations', 'value': 0}] + \
+    [{'label': '{:,} beats'.format(10**k), 'value': 10**k} for k in range(4, 7)]
+n_buckets_long_run = 2000
+
+
+# Maximum number of iterations used to find the long-term regime
+nmax_regime = 5000
+
+@lru_cache(maxsize=256)
+def get_regime_text(apd0, model_name, params, theta, ts):
+    '''
+    Iterate until the trajectory settles on a cycle and label the regime
+    by its stimulus:response ratio
+    '''
+    transient, period, cycle = find_cobweb_cycle_model(
+        restitution_models[model_name], nmax_regime, apd0, params, theta, ts)
+    if period == 0:
+        return 'Regime: no cycle detected within {} beats'.format(nmax_regime)
+    return 'Regime: {} (period {}, transient {} beats)'.format(
+        classify_cycle(cycle, theta, ts), period, len(transient))
 
 
 #--------------------
@@ -96,6 +141,10 @@ fig_apd_sequence = make_apd_sequence(apd_traj)
 size_slider_text = '15px'
 size_title = '30px'
 
+# When the sliders send their value: 'mouseup' (on release) or 'drag'
+# (continuously while dragged, with stale requests dropped by coalesce.py)
+slider_updatemode = os.environ.get('COBWEB_SLIDER_UPDATEMODE', 'mouseup')
+
 # Parameter bounds
 apd0_min = 0
 apd0_max = 250
@@ -107,14 +156,14 @@ nmax_max = 100
 # nmax_step = 20
 # nmax_marks = {float(x):str(round(x,2)) for x in np.arange(nmax_min,nmax_max,20)}
 
-# apdmax_min = 100
-# apdmax_max = 300
+apdmax_min = 100
+apdmax_max = 300
 
-# alpha_min = 0
-# alpha_max = 200
+alpha_min = 0
+alpha_max = 200
 
-# tau_min = 10
-# tau_max = 190
+tau_min = 10
+tau_max = 190
 
 
 a_min = 100
@@ -134,6 +183,240 @@ ts_max = 500
 # ts_step = 100
 # ts_marks = {float(x):str(round(x,2)) for x in np.arange(ts_min,ts_max,100)}
 
+# Precomputed store for the bifurcation diagram and regime map of the
+# sigmoid model, built offline with tile_store.py. Panels are computed (with
+# the same settings as the store) when it does not cover the current model
+# and parameters.
+tile_store = open_tile_store(os.environ.get(
+    'COBWEB_TILES', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tiles')))
+if tile_store is not None:
+    print('Using precomputed tiles from {}'.format(tile_store.path))
+
+# Values of ts used for the bifurcation diagram
+ts_vals_bif = np.linspace(ts_min, ts_max, 401)
+
+# Memoized bifurcation data (does not depend on the current ts)
+@lru_cache(maxsize=32)
+def get_bifurcation_data(apd0, model_name, params, theta):
+    if tile_store is not None and model_name == 'sigmoid':
+        data = tile_store.bifurcation(apd0, *params, theta, ts_vals_bif)
+        if data is not None:
+            return data
+    return compute_bifurcation_data_model(
+        restitution_models[model_name], apd0, params, theta, ts_vals_bif,
+        n_transient=panel_settings['n_transient'], n_keep=panel_settings['n_keep'])
+
+
+# Slider bounds of the parameters that can be varied in the regime map
+param_bounds = {
+    'apd0': (apd0_min, apd0_max),
+    'apdmax': (apdmax_min, apdmax_max),
+    'alpha': (alpha_min, alpha_max),
+    'tau': (tau_min, tau_max),
+    'a': (a_min, a_max),
+    'b': (b_min, b_max),
+    'x0': (x0_min, x0_max),
+    'theta': (theta_min, theta_max),
+    'ts': (ts_min, ts_max),
+    }
+
+def get_regime_options(model_name):
+    '''
+    Parameters that can be varied in the regime map of a model
+    '''
+    return ['apd0'] + list(restitution_models[model_name].param_names) + ['theta', 'ts']
+
+# Number of grid points along each axis of the regime map
+n_grid_regime = 150
+
+# Default axes and quantity shown in the regime map
+regime_x = 'ts'
+regime_y = 'b'
+regime_quantity = 'period'
+
+@lru_cache(maxsize=16)
+def get_regime_map(model_name, x_name, y_name, **params):
+    '''
+    Regime map over the full slider ranges of x_name and y_name, with the
+    other parameters at their current values. Call with the values of
+    x_name and y_name set to None so that the cache ignores them.
+    '''
+    x_vals = np.linspace(*param_bounds[x_name], n_grid_regime)
+    y_vals = np.linspace(*param_bounds[y_name], n_grid_regime)
+    if tile_store is not None and model_name == 'sigmoid':
+        data = tile_store.regime_map(x_name, x_vals, y_name, y_vals, params)
+        if data is not None:
+            return data
+    period, lyapunov, n_stim = compute_regime_map(params, x_name, x_vals, y_name, y_vals,
+                                                  model=restitution_models[model_name],
+                                                  **panel_settings)
+    return x_vals, y_vals, period, lyapunov, n_stim
+
+# Initial conditions of the basins of attraction (one batched iteration)
+n_grid_basin = 10**5
+apd0_vals_basin = np.linspace(apd0_min, apd0_max, n_grid_basin)
+
+@lru_cache(maxsize=32)
+def get_basins(model_name, params, theta, ts):
+    '''
+    Attractor of each initial condition in apd0_vals_basin (does not depend
+    on the current apd0)
+    '''
+    return compute_basins_model(restitution_models[model_name], apd0_vals_basin,
+                                params, theta, ts)
+
+def make_basin_fig_app(model_name, params, theta, ts, apd0):
+    labels, attractors = get_basins(model_name, params, theta, ts)
+    return make_basin_fig(apd0_vals_basin, labels, attractors, theta, ts, apd0_current=apd0)
+
+def make_regime_fig(model_name, x_name, y_name, quantity, apd0, params, theta, ts):
+    model = restitution_models[model_name]
+    params = dict(zip(model.param_names, params), apd0=apd0, theta=theta, ts=ts)
+    key = dict(params, **{x_name:None, y_name:None})
+    x_vals, y_vals, period, lyapunov, n_stim = get_regime_map(model_name, x_name, y_name, **key)
+    return make_regime_map_fig(x_name, x_vals, y_name, y_vals, period, lyapunov, n_stim,
+                               quantity=quantity,
+                               x_current=params[x_name], y_current=params[y_name])
+
+
+
+# Figures of the layout for the default parameters. These are loaded from a
+# prebuilt file (see build_default_figures) if it was made from the current
+# code, and otherwise computed and saved to the file, so later starts of the
+# app load them. With gunicorn --preload they are loaded (or built) once,
+# before the workers fork, and shared by the workers.
+app_dir = os.path.dirname(os.path.abspath(__file__))
+path_defaults = os.environ.get('COBWEB_DEFAULTS', os.path.join(app_dir, 'default_figures.json'))
+
+def get_defaults_key():
+    '''
+    Hash of the code and package versions that the default figures depend on
+    '''
+    import plotly
+    h = hashlib.sha1()
+    for filename in ('app.py', 'app_functions.py'):
+        with open(os.path.join(app_dir, filename), 'rb') as f:
+            h.update(f.read())
+    h.update(plotly.__version__.encode())
+    h.update(dash.__version__.encode())
+    return h.hexdigest()
+
+def compute_default_figures():
+    '''
+    Figures (as dicts) and regime text of the layout for the default parameters
+    '''
+    apd_traj = generate_cobweb_trajectory_model(model, nmax, apd0, params, theta, ts)
+    ts_plot, apd_plot = get_bifurcation_data(apd0, model_name, params, theta)
+    figs = {
+        'fig_cobweb': make_cobweb_fig_model(model, params, theta, ts, apd_traj),
+        'fig_restitution': make_restitution_fig_model(model, params),
+        'fig_apd_sequence': make_apd_sequence(apd_traj),
+        'fig_bifurcation': make_bifurcation_fig(ts_plot, apd_plot, ts),
+        'fig_basin': make_basin_fig_app(model_name, params, theta, ts, apd0),
+        'fig_regime': make_regime_fig(model_name, regime_x, regime_y, regime_quantity,
+                                      apd0, params, theta, ts),
+        }
+    defaults = {name: json.loads(fig.to_json()) for name, fig in figs.items()}
+    defaults['regime_text'] = get_regime_text(apd0, model_name, params, theta, ts)
+    return defaults
+
+def build_default_figures(path=path_defaults, figures=None):
+    '''
+    Compute the default figures (unless given) and save them to path. The
+    file is replaced atomically, as several processes may build it at once.
+    '''
+    if figures is None:
+        figures = compute_default_figures()
+    path_tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(path_tmp, 'w') as f:
+        json.dump({'key': get_defaults_key(), 'figures': figures}, f)
+    os.replace(path_tmp, path)
+    return figures
+
+def load_default_figures(path=path_defaults):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('key') == get_defaults_key():
+            return data['figures']
+        print('Default figures in {} are out of date'.format(path))
+    except (OSError, ValueError):
+        pass
+    figures = compute_default_figures()
+    try:
+        build_default_figures(path, figures)
+        print('Saved default figures to {}'.format(path))
+    except OSError:
+        pass
+    return figures
+
+
+# Encoding of the trace data of each figure (see encode_array in
+# app_functions). Set it for all figures with e.g. COBWEB_ENCODING=round,
+# or per figure with e.g. COBWEB_ENCODING=fig_cobweb=bdata,fig_regime=json
+figure_encodings = {
+    'fig_cobweb': 'bdata',
+    'fig_restitution': 'bdata',
+    'fig_apd_sequence': 'bdata',
+    'fig_bifurcation': 'bdata',
+    'fig_basin': 'bdata',
+    'fig_regime': 'bdata',
+    }
+for item in filter(None, os.environ.get('COBWEB_ENCODING', '').split(',')):
+    if '=' in item:
+        name, encoding = item.split('=', 1)
+        figure_encodings[name.strip()] = encoding.strip()
+    else:
+        figure_encodings = dict.fromkeys(figure_encodings, item.strip())
+
+def encode(fig_name, values):
+    '''
+    Encode trace data for figure fig_name
+    '''
+    return encode_array(values, figure_encodings[fig_name])
+
+# Cache of results shared by the workers (see result_cache.py), off unless
+# COBWEB_CACHE is set. Keys include the code and the encodings, so results
+# of other versions are never used.
+result_cache = open_result_cache(
+    version=get_defaults_key() + json.dumps(figure_encodings, sort_keys=True))
+
+default_figures = load_default_figures()
+fig_cobweb = encode_figure(default_figures['fig_cobweb'], figure_encodings['fig_cobweb'])
+fig_restitution = encode_figure(default_figures['fig_restitution'], figure_encodings['fig_restitution'])
+fig_apd_sequence = encode_figure(default_figures['fig_apd_sequence'], figure_encodings['fig_apd_sequence'])
+fig_bifurcation = encode_figure(default_figures['fig_bifurcation'], figure_encodings['fig_bifurcation'])
+fig_basin = encode_figure(default_figures['fig_basin'], figure_encodings['fig_basin'])
+fig_regime = encode_figure(default_figures['fig_regime'], figure_encodings['fig_regime'])
+regime_text = default_figures['regime_text']
+
+def figure_key(*values):
+    '''
+    Key of the parameters that a figure was computed for, as kept in a
+    dcc.Store next to it (JSON, so tuples become lists)
+    '''
+    return json.loads(json.dumps(values))
+
+def regime_key(model_name, x_name, y_name, quantity, apd0, params, theta, ts):
+    '''
+    Key of the heatmap of the regime map, which does not depend on the
+    parameters on its axes
+    '''
+    values = dict(zip(restitution_models[model_name].param_names, params),
+                  apd0=apd0, theta=theta, ts=ts)
+    values.update({x_name: None, y_name: None})
+    return figure_key(model_name, x_name, y_name, quantity, values)
+
+# Keys of the figures in the layout (see the callbacks below)
+figure_keys = {
+    'restitution_key': figure_key(model_name, params),
+    'cobweb_key': figure_key(model_name, params, theta, ts, apd0),
+    'bifurcation_key': figure_key(model_name, params, apd0, theta),
+    'basin_key': figure_key(model_name, params, theta, ts),
+    'regime_key': regime_key(model_name, regime_x, regime_y, regime_quantity,
+                             apd0, params, theta, ts),
+    }
+
 
 # # PDF image of text
 # image_filename = 'diff_eqn.png' # replace with your own image
@@ -189,11 +472,22 @@ app.layout = html.Div([
         #                 'color':'black'}
         # ),
 
+        # Dropdown for the restitution model
+		html.Label('Restitution model',
+ 				   style={'fontSize':size_slider_text}),
+		dcc.Dropdown(id='model_dropdown',
+ 				   options=[{'label':m.label, 'value':name}
+                            for name, m in restitution_models.items()],
+ 				   value=model_name,
+ 				   clearable=False,
+		),
+
         # Slider for apd0
 		html.Label('APD_0 = {} ms'.format(apd0),
  				   id='apd0_slider_text',
  				   style={'fontSize':size_slider_text}),  
 		dcc.Slider(id='apd0_slider',
+ 				   updatemode=slider_updatemode,
  				   min=apd0_min, 
  				   max=apd0_max, 
  				   # step=apd0_step,
@@ -208,6 +502,7 @@ app.layout = html.Div([
  				   style={'fontSize':size_slider_text}),  
  				   
 		dcc.Slider(id='nmax_slider',
+ 				   updatemode=slider_updatemode,
  				   min=nmax_min, 
  				   max=nmax_max, 
  				   # step=nmax_step, 
@@ -216,45 +511,54 @@ app.layout = html.Div([
 		),
 
         
-#         # Slider for apdmax
-# 		html.Label('APD_max = {} ms'.format(apdmax),
-#  				   id='apdmax_slider_text',
-#  				   style={'fontSize':size_slider_text}),  
+        # Sliders for the exponential model
+		html.Div([
+		
+        # Slider for apdmax
+		html.Label('APD_max = {} ms'.format(apdmax),
+ 				   id='apdmax_slider_text',
+ 				   style={'fontSize':size_slider_text}),  
  				   
-# 		dcc.Slider(id='apdmax_slider',
-#  				   min=apdmax_min, 
-#  				   max=apdmax_max, 
-#  				   # step=y0_step,
-#  				   # marks=y0_marks,
-#  				   value=apdmax
-# 		),   
+		dcc.Slider(id='apdmax_slider',
+ 				   updatemode=slider_updatemode,
+ 				   min=apdmax_min, 
+ 				   max=apdmax_max, 
+ 				   value=apdmax
+		),   
 
         
-#         # Slider for alpha
-# 		html.Label('alpha = {} ms'.format(alpha),
-#  				   id='alpha_slider_text',
-#  				   style={'fontSize':size_slider_text}),  
+        # Slider for alpha
+		html.Label('alpha = {} ms'.format(alpha),
+ 				   id='alpha_slider_text',
+ 				   style={'fontSize':size_slider_text}),  
  				   
-# 		dcc.Slider(id='alpha_slider',
-#  				   min=alpha_min, 
-#  				   max=alpha_max, 
-#  				   value=alpha
-# 		),           
+		dcc.Slider(id='alpha_slider',
+ 				   updatemode=slider_updatemode,
+ 				   min=alpha_min, 
+ 				   max=alpha_max, 
+ 				   value=alpha
+		),           
         
         
-#         # Slider for tau
-# 		html.Label('tau = {} ms'.format(tau),
-#  				   id='tau_slider_text',
-#  				   style={'fontSize':size_slider_text}),  
+        # Slider for tau
+		html.Label('tau = {} ms'.format(tau),
+ 				   id='tau_slider_text',
+ 				   style={'fontSize':size_slider_text}),  
  				   
-# 		dcc.Slider(id='tau_slider',
-#  				   min=tau_min, 
-#  				   max=tau_max, 
-#  				   value=tau,
-# 		),           
-        
+		dcc.Slider(id='tau_slider',
+ 				   updatemode=slider_updatemode,
+ 				   min=tau_min, 
+ 				   max=tau_max, 
+ 				   value=tau,
+		),           
+		],
+		id='exponential_sliders',
+		style={'display': 'block' if model_name == 'exponential' else 'none'},
+		),
         
         
+        # Sliders for the sigmoid model
+		html.Div([
           
         # Slider for a
 		html.Label('a = {} ms'.format(a),
@@ -262,6 +566,7 @@ app.layout = html.Div([
  				   style={'fontSize':size_slider_text}),  
  				   
 		dcc.Slider(id='a_slider',
+ 				   updatemode=slider_updatemode,
  				   min=a_min, 
  				   max=a_max, 
  				   # step=y0_step,
@@ -276,6 +581,7 @@ app.layout = html.Div([
  				   style={'fontSize':size_slider_text}),  
  				   
 		dcc.Slider(id='b_slider',
+ 				   updatemode=slider_updatemode,
  				   min=b_min, 
  				   max=b_max, 
  				   value=b
@@ -288,10 +594,15 @@ app.layout = html.Div([
  				   style={'fontSize':size_slider_text}),  
  				   
 		dcc.Slider(id='x0_slider',
+ 				   updatemode=slider_updatemode,
  				   min=x0_min, 
  				   max=x0_max, 
  				   value=x0,
 		),           
+		],
+		id='sigmoid_sliders',
+		style={'display': 'block' if model_name == 'sigmoid' else 'none'},
+		),
         
         
         
@@ -301,6 +612,7 @@ app.layout = html.Div([
  				   style={'fontSize':size_slider_text}),  
  				   
 		dcc.Slider(id='theta_slider',
+ 				   updatemode=slider_updatemode,
  				   min=theta_min, 
  				   max=theta_max, 
  				   # step=theta_step,
@@ -319,15 +631,37 @@ app.layout = html.Div([
  				   
         
 		dcc.Slider(id='ts_slider',
+ 				   updatemode=slider_updatemode,
  				   min=ts_min, 
  				   max=ts_max, 
  				   # step=1,
  				   # marks=ts_marks,
  				   value=ts
-		),],                  
+		),
+        
+        
+        # Fitted parameters (table from fitting.py, or S1-S2 datasets
+        # with DI and APD columns that are fitted on upload)
+		dcc.Upload(id='fit_upload',
+ 				   children=html.Div(['Drop or ', html.A('select'),
+                                      ' S1-S2 datasets or a table of fits']),
+ 				   multiple=True,
+ 				   style={'fontSize':size_slider_text,
+                          'borderWidth':'1px',
+                          'borderStyle':'dashed',
+                          'borderRadius':'5px',
+                          'textAlign':'center',
+                          'padding':'5px'},
+		),
+		dcc.Dropdown(id='fit_dropdown',
+ 				   options=[],
+ 				   placeholder='Load fitted parameters',
+		),
+		dcc.Store(id='fit_store'),
+        ],                  
          
 		style={'width':'25%',
-			   'height':'470px',
+			   'height':'620px',
 			   'fontSize':'10px',
 			   'padding-left':'3%',
 			   'padding-right':'2%',
@@ -346,6 +680,7 @@ app.layout = html.Div([
    				   figure = fig_restitution,
    				   # config={'displayModeBar': False},
    				   ),
+         dcc.Store(id='restitution_key', data=figure_keys['restitution_key']),
    		 ],
   		style={'width':'30%',
   			   'height':'470px',
@@ -356,16 +691,23 @@ app.layout = html.Div([
   			   'display':'inline-block'},
    	),
   
-   	# Cobweb plot
+   	# Cobweb plot and basins of attraction
    	html.Div(
   		[dcc.Graph(id='fig_cobweb',
                    mathjax=True,
    				   figure = fig_cobweb,
    				   # config={'displayModeBar': False},
    				   ),
+  		 dcc.Graph(id='fig_basin',
+                   mathjax=True,
+   				   figure = fig_basin,
+   				   style={'height':'180px'},
+   				   ),
+         dcc.Store(id='cobweb_key', data=figure_keys['cobweb_key']),
+         dcc.Store(id='basin_key', data=figure_keys['basin_key']),
    		 ],
   		style={'width':'30%',
-  			   'height':'470px',
+  			   'height':'650px',
   			   'fontSize':'15px',
   			   'padding-left':'0%',
   			   'padding-right':'0%',
@@ -373,6 +715,30 @@ app.layout = html.Div([
   			   'display':'inline-block'},
    	),     
 
+   	# Long-term regime
+   	html.Div(regime_text,
+             id='regime_text',
+  		style={'width':'90%',
+  			   'fontSize':size_slider_text,
+  			   'padding-left':'5%',
+  			   'padding-right':'5%',
+  			   'textAlign':'center'},
+   	),     
+
+   	# Length of the APD sequence
+   	html.Div(
+  		[html.Label('APD sequence', style={'fontSize':size_slider_text}),
+         dcc.Dropdown(id='long_run_dropdown',
+                      options=long_run_options,
+                      value=long_run,
+                      clearable=False,
+                      ),
+         ],
+  		style={'width':'20%',
+  			   'padding-left':'5%',
+  			   'display':'inline-block'},
+   	),
+
    	# APD sequence
    	html.Div(
   		[dcc.Graph(id='fig_apd_sequence',
@@ -390,6 +756,75 @@ app.layout = html.Div([
   			   'display':'inline-block'},
    	),     
 
+   	# Bifurcation diagram
+   	html.Div(
+  		[dcc.Graph(id='fig_bifurcation',
+                   mathjax=True,
+   				   figure = fig_bifurcation,
+   				   # config={'displayModeBar': False},
+   				   ),
+         dcc.Store(id='bifurcation_key', data=figure_keys['bifurcation_key']),
+   		 ],
+  		style={'width':'90%',
+  			   'height':'320px',
+  			   'fontSize':'15px',
+  			   'padding-left':'5%',
+  			   'padding-right':'5%',
+  			   'vertical-align': 'middle',
+  			   'display':'inline-block'},
+   	),     
+
+   	# Regime map
+   	html.Div(
+  		[html.Div([
+            html.Label('x-axis', style={'fontSize':size_slider_text}),
+            dcc.Dropdown(id='regime_x_dropdown',
+                         options=get_regime_options(model_name),
+                         value=regime_x,
+                         clearable=False,
+                         ),
+            ],
+            style={'width':'20%', 'display':'inline-block', 'padding-right':'2%'},
+            ),
+         html.Div([
+            html.Label('y-axis', style={'fontSize':size_slider_text}),
+            dcc.Dropdown(id='regime_y_dropdown',
+                         options=get_regime_options(model_name),
+                         value=regime_y,
+                         clearable=False,
+                         ),
+            ],
+            style={'width':'20%', 'display':'inline-block', 'padding-right':'2%'},
+            ),
+         html.Div([
+            html.Label('Show', style={'fontSize':size_slider_text}),
+            dcc.Dropdown(id='regime_quantity_dropdown',
+                         options=[
+                             {'label':'Period', 'value':'period'},
+                             {'label':'Lyapunov exponent', 'value':'lyapunov'},
+                             {'label':'Stimulus:response ratio', 'value':'ratio'},
+                             ],
+                         value=regime_quantity,
+                         clearable=False,
+                         ),
+            ],
+            style={'width':'25%', 'display':'inline-block'},
+            ),
+         dcc.Graph(id='fig_regime',
+                   mathjax=True,
+   				   figure = fig_regime,
+   				   # config={'displayModeBar': False},
+   				   ),
+         dcc.Store(id='regime_key', data=figure_keys['regime_key']),
+   		 ],
+  		style={'width':'90%',
+  			   'fontSize':'15px',
+  			   'padding-left':'5%',
+  			   'padding-right':'5%',
+  			   'vertical-align': 'middle',
+  			   'display':'inline-block'},
+   	),     
+
 
     # Footer
     html.Footer(
@@ -420,6 +855,9 @@ app.layout = html.Div([
         [
          Output('apd0_slider_text','children'),
          Output('nmax_slider_text','children'),
+         Output('apdmax_slider_text','children'),
+         Output('alpha_slider_text','children'),
+         Output('tau_slider_text','children'),
          Output('a_slider_text','children'),
          Output('b_slider_text','children'),
          Output('x0_slider_text','children'),
@@ -429,9 +867,9 @@ app.layout = html.Div([
         [
           Input('apd0_slider','value'),
           Input('nmax_slider','value'),
-          # Input('apdmax_slider','value'),
-          # Input('alpha_slider','value'),
-          # Input('tau_slider','value'),
+          Input('apdmax_slider','value'),
+          Input('alpha_slider','value'),
+          Input('tau_slider','value'),
           Input('a_slider','value'),
           Input('b_slider','value'),
           Input('x0_slider','value'),
@@ -440,73 +878,483 @@ app.layout = html.Div([
           ]
 )
 
-def update_slider_text(apd0,nmax,a,b,x0,theta,ts):
+@profile_callback
+def update_slider_text(apd0,nmax,apdmax,alpha,tau,a,b,x0,theta,ts):
     
     # Slider text update
     text_apd0 = 'APD_0 = {} ms'.format(apd0)
     text_nmax = '# iterations = {}'.format(nmax)
-    # text_apdmax = 'APD_max = {} ms'.format(apdmax)
-    # text_alpha = 'alpha = {} ms'.format(alpha)
-    # text_tau = 'tau = {} ms'.format(tau)
+    text_apdmax = 'APD_max = {} ms'.format(apdmax)
+    text_alpha = 'alpha = {} ms'.format(alpha)
+    text_tau = 'tau = {} ms'.format(tau)
     text_a = 'a = {} ms'.format(a)
     text_b = 'b = {} ms'.format(b)
     text_x0 = 'x0 = {} ms'.format(x0)
     text_theta = 'theta = {} ms'.format(theta)
     text_ts = 'ts = {} ms'.format(ts)
 
-    return text_apd0,text_nmax,text_a,text_b,text_x0,text_theta,text_ts
+    return text_apd0,text_nmax,text_apdmax,text_alpha,text_tau,text_a,text_b,text_x0,text_theta,text_ts
             
 
 
-# Update figures
+# Show the sliders of the selected restitution model
+@app.callback(
+        [
+         Output('exponential_sliders','style'),
+         Output('sigmoid_sliders','style'),
+          ],
+        Input('model_dropdown','value'),
+        prevent_initial_call=True,
+)
+
+@profile_callback
+def update_model_sliders(model_name):
+    
+    return [{'display': 'block' if model_name == name else 'none'}
+            for name in ('exponential', 'sigmoid')]
+
+
+# Memoized trajectory, keyed on the simulation and model parameters
+@lru_cache(maxsize=256)
+@memoize(result_cache, 'apd_traj')
+def get_apd_traj(nmax, apd0, model_name, params, theta, ts):
+    return tuple(generate_cobweb_trajectory_model(
+        restitution_models[model_name], nmax, apd0, params, theta, ts))
+
+# Memoized map curve (also memoized per process in app_functions), shared
+# by the workers through the result cache
+@lru_cache(maxsize=256)
+@memoize(result_cache, 'map_sample')
+def get_map_sample(model_name, params, theta, ts):
+    return sample_cobweb_map_model(restitution_models[model_name], params, theta, ts)
+
+# Memoized long run for the APD sequence (iteration numbers and APD values
+# of the downsampled trajectory)
+@lru_cache(maxsize=32)
+@memoize(result_cache, 'long_run')
+def get_long_run(n_beats, apd0, model_name, params, theta, ts):
+    return downsample_cobweb_trajectory_model(
+        restitution_models[model_name], n_beats, apd0, params, theta, ts,
+        n_buckets=n_buckets_long_run)
+
+
+
+
+
+# The figures in the layout are built with the default parameters, so the
+# callbacks below only send the trace data that changed (as a Patch) and
+# are not called when the page first loads. Switching the restitution model
+# changes titles and axis ranges, so then the full figures are sent.
+#
+# What changed is found from the key of the parameters each figure shows,
+# kept in a dcc.Store (State) that is updated in the same response, and not
+# from the inputs that triggered the callback: when a request is superseded
+# the renderer drops it, and the next request does not carry its changed
+# inputs.
+
+# Trace indices of the figures made in app_functions
+TRACE_MAP = 0
+TRACE_TRAJ = 2
+TRACE_FIXED = 3
+
+
+# Update restitution curve (only depends on the restitution parameters)
 @app.callback(
             Output('fig_restitution','figure'),
+            Output('restitution_key','data'),
+            [
+          Input('model_dropdown','value'),
+          Input('apdmax_slider','value'),
+          Input('alpha_slider','value'),
+          Input('tau_slider','value'),
+          Input('a_slider','value'),
+          Input('b_slider','value'),
+          Input('x0_slider','value'),
+            ],
+            State('restitution_key','data'),
+            prevent_initial_call=True,
+            )
+
+@coalesce_callback
+@profile_callback
+def update_restitution_fig(model_name, apdmax, alpha, tau, a, b, x0, shown_key):
+    
+    model, params = get_model_params(model_name, apdmax, alpha, tau, a, b, x0)
+    key = figure_key(model_name, params)
+    if key == shown_key:
+        raise PreventUpdate
+    if not shown_key or shown_key[0] != model_name:
+        return (encode_figure(make_restitution_fig_model(model, params),
+                              figure_encodings['fig_restitution']),
+                key)
+    
+    # DI values of the curve are fixed so only send new APD values
+    x, y = model.sample_curve(*params)
+    fig_restitution = Patch()
+    fig_restitution['data'][0]['y'] = encode('fig_restitution', y)
+    
+    return fig_restitution, key
+
+
+
+# Update figures that depend on the trajectory
+@app.callback(
             Output('fig_cobweb','figure'),
             Output('fig_apd_sequence','figure'),
+            Output('regime_text','children'),
+            Output('cobweb_key','data'),
             [
           Input('apd0_slider','value'),
           Input('nmax_slider','value'),
-          # Input('apdmax_slider','value'),
-          # Input('alpha_slider','value'),
-          # Input('tau_slider','value'),
+          Input('model_dropdown','value'),
+          Input('apdmax_slider','value'),
+          Input('alpha_slider','value'),
+          Input('tau_slider','value'),
           Input('a_slider','value'),
           Input('b_slider','value'),
           Input('x0_slider','value'),
           Input('theta_slider','value'),
           Input('ts_slider','value'),      
+          Input('long_run_dropdown','value'),
             ],
+            State('cobweb_key','data'),
+            prevent_initial_call=True,
             )
 
-def update_figs(apd0, nmax, a, b, x0, theta, ts):
+@coalesce_callback
+@profile_callback
+def update_figs(apd0, nmax, model_name, apdmax, alpha, tau, a, b, x0, theta, ts, long_run,
+                shown_key):
+    
+    model, params = get_model_params(model_name, apdmax, alpha, tau, a, b, x0)
     
+    # Key of the regime text, and of the map curve without apd0
+    key = figure_key(model_name, params, theta, ts, apd0)
+    shown_key = shown_key or [None]*len(key)
 
     # Generate cobweb trajectory
-    # apd_traj = generate_cobweb_trajectory(nmax, apd0, apdmax, alpha, tau, theta, ts)
-    apd_traj = generate_cobweb_trajectory_sigmoid(nmax, apd0, a, b, x0, theta, ts)
+    apd_traj = get_apd_traj(nmax, apd0, model_name, params, theta, ts)
+    
+    # APD sequence: the cobweb trajectory, or a downsampled long run
+    if long_run:
+        beats, apd_seq = get_long_run(long_run, apd0, model_name, params, theta, ts)
+    else:
+        beats, apd_seq = np.arange(len(apd_traj)), apd_traj
+    
+    # Label for the long-term regime (does not depend on nmax or the long run)
+    if key == shown_key:
+        regime_text = dash.no_update
+    else:
+        regime_text = get_regime_text(apd0, model_name, params, theta, ts)
+    
+    if shown_key[0] != model_name:
+        return (encode_figure(make_cobweb_fig_model(model, params, theta, ts, apd_traj),
+                              figure_encodings['fig_cobweb']),
+                encode_figure(make_apd_sequence(apd_seq, beats if long_run else None),
+                              figure_encodings['fig_apd_sequence']),
+                regime_text, key)
+
+    fig_cobweb = Patch()
+    
+    # Map curve is memoized on the model and (params, theta, ts) and only
+    # sent when one of these changed
+    if key[:-1] != shown_key[:-1]:
+        xVals, yVals = get_map_sample(model_name, params, theta, ts)
+        fig_cobweb['data'][TRACE_MAP]['x'] = encode('fig_cobweb', xVals)
+        fig_cobweb['data'][TRACE_MAP]['y'] = encode('fig_cobweb', yVals)
+        # Fixed points of each branch
+        apd_fp, slope, stable = find_fixed_points_model(model, params, theta, ts)
+        x_fp, symbols_fp = fixed_point_markers(apd_fp, stable)
+        fig_cobweb['data'][TRACE_FIXED]['x'] = x_fp
+        fig_cobweb['data'][TRACE_FIXED]['y'] = x_fp
+        fig_cobweb['data'][TRACE_FIXED]['marker']['symbol'] = symbols_fp
+    
+    # Trajectory
+    x_traj, y_traj = cobweb_staircase(apd_traj)
+    fig_cobweb['data'][TRACE_TRAJ]['x'] = encode('fig_cobweb', x_traj)
+    fig_cobweb['data'][TRACE_TRAJ]['y'] = encode('fig_cobweb', y_traj)
+    
+    # APD sequence
+    fig_apd_sequence = Patch()
+    fig_apd_sequence['data'][0]['x'] = encode('fig_apd_sequence', beats)
+    fig_apd_sequence['data'][0]['y'] = encode('fig_apd_sequence', apd_seq)
+    fig_apd_sequence['data'][0]['mode'] = 'lines' if long_run else 'markers+lines'
+    
+
+    return fig_cobweb, fig_apd_sequence, regime_text, key
+
+
+
+# Update bifurcation diagram
+@app.callback(
+            Output('fig_bifurcation','figure'),
+            Output('bifurcation_key','data'),
+            [
+          Input('apd0_slider','value'),
+          Input('model_dropdown','value'),
+          Input('apdmax_slider','value'),
+          Input('alpha_slider','value'),
+          Input('tau_slider','value'),
+          Input('a_slider','value'),
+          Input('b_slider','value'),
+          Input('x0_slider','value'),
+          Input('theta_slider','value'),
+          Input('ts_slider','value'),      
+            ],
+            State('bifurcation_key','data'),
+            prevent_initial_call=True,
+            )
+
+@coalesce_callback
+@profile_callback
+def update_bifurcation_fig(apd0, model_name, apdmax, alpha, tau, a, b, x0, theta, ts,
+                           shown_key):
+    
+    model, params = get_model_params(model_name, apdmax, alpha, tau, a, b, x0)
+    key = figure_key(model_name, params, apd0, theta)
+    fig_bifurcation = Patch()
+    
+    # Vectorized sweep over all values of ts at once. Not needed if only
+    # the marker for the current ts moved.
+    if key != shown_key:
+        ts_plot, apd_plot = get_bifurcation_data(apd0, model_name, params, theta)
+        fig_bifurcation['data'][0]['x'] = encode('fig_bifurcation', ts_plot)
+        fig_bifurcation['data'][0]['y'] = encode('fig_bifurcation', apd_plot)
+    
+    # Line marking the current ts
+    fig_bifurcation['layout']['shapes'][0]['x0'] = ts
+    fig_bifurcation['layout']['shapes'][0]['x1'] = ts
+    
+    return fig_bifurcation, key
+
+
+# Update basins of attraction
+@app.callback(
+            Output('fig_basin','figure'),
+            Output('basin_key','data'),
+            [
+          Input('apd0_slider','value'),
+          Input('model_dropdown','value'),
+          Input('apdmax_slider','value'),
+          Input('alpha_slider','value'),
+          Input('tau_slider','value'),
+          Input('a_slider','value'),
+          Input('b_slider','value'),
+          Input('x0_slider','value'),
+          Input('theta_slider','value'),
+          Input('ts_slider','value'),      
+            ],
+            State('basin_key','data'),
+            prevent_initial_call=True,
+            )
+
+@coalesce_callback
+@profile_callback
+def update_basin_fig(apd0, model_name, apdmax, alpha, tau, a, b, x0, theta, ts,
+                     shown_key):
+    
+    model, params = get_model_params(model_name, apdmax, alpha, tau, a, b, x0)
+    key = figure_key(model_name, params, theta, ts)
+    
+    # Basins do not depend on apd0, so only move the line marking it
+    if key == shown_key:
+        fig_basin = Patch()
+        fig_basin['layout']['shapes'][0]['x0'] = apd0
+        fig_basin['layout']['shapes'][0]['x1'] = apd0
+        return fig_basin, key
+    
+    # Number of attractors (traces and colors) can change, so send the
+    # full figure
+    return (encode_figure(make_basin_fig_app(model_name, params, theta, ts, apd0),
+                          figure_encodings['fig_basin']),
+            key)
+
 
+# Parameters available on the axes of the regime map
+@app.callback(
+            [
+          Output('regime_x_dropdown','options'),
+          Output('regime_x_dropdown','value'),
+          Output('regime_y_dropdown','options'),
+          Output('regime_y_dropdown','value'),
+            ],
+            Input('model_dropdown','value'),
+            [
+          State('regime_x_dropdown','value'),
+          State('regime_y_dropdown','value'),
+            ],
+            prevent_initial_call=True,
+            )
 
-    # # Make figures
-    # fig_cobweb = make_cobweb_fig(apdmax, alpha, tau, theta, ts, apd_traj)
-    # fig_restitution = make_restitution_fig(apdmax, alpha, tau)
-    # fig_apd_sequence = make_apd_sequence(apd_traj)
+@profile_callback
+def update_regime_options(model_name, x_name, y_name):
+    
+    # Keep the axes if the new model has them, otherwise use ts and the
+    # second parameter of the model
+    options = get_regime_options(model_name)
+    if x_name not in options:
+        x_name = 'ts'
+    if y_name not in options or y_name == x_name:
+        y_name = restitution_models[model_name].param_names[1]
+    
+    return options, x_name, options, y_name
 
-    # Make figures (sigmoid)
-    fig_cobweb = make_cobweb_fig_sigmoid(a, b, x0, theta, ts, apd_traj)
-    fig_restitution = make_restitution_fig_sigmoid(a, b, x0)
-    fig_apd_sequence = make_apd_sequence(apd_traj)
 
 
-    return fig_restitution, fig_cobweb, fig_apd_sequence
+# Update regime map
+@app.callback(
+            Output('fig_regime','figure'),
+            Output('regime_key','data'),
+            [
+          Input('regime_x_dropdown','value'),
+          Input('regime_y_dropdown','value'),
+          Input('regime_quantity_dropdown','value'),
+          Input('apd0_slider','value'),
+          Input('model_dropdown','value'),
+          Input('apdmax_slider','value'),
+          Input('alpha_slider','value'),
+          Input('tau_slider','value'),
+          Input('a_slider','value'),
+          Input('b_slider','value'),
+          Input('x0_slider','value'),
+          Input('theta_slider','value'),
+          Input('ts_slider','value'),      
+            ],
+            State('regime_key','data'),
+            prevent_initial_call=True,
+            )
+
+@coalesce_callback
+@profile_callback
+def update_regime_fig(x_name, y_name, quantity, apd0, model_name,
+                      apdmax, alpha, tau, a, b, x0, theta, ts, shown_key):
+    
+    model, params = get_model_params(model_name, apdmax, alpha, tau, a, b, x0)
+    values = dict(zip(model.param_names, params), apd0=apd0, theta=theta, ts=ts)
+    
+    # Axes of the previous model, until the dropdowns are updated
+    if x_name not in values or y_name not in values:
+        raise PreventUpdate
+    
+    # Only move the marker if only the parameters on the axes changed
+    key = regime_key(model_name, x_name, y_name, quantity, apd0, params, theta, ts)
+    if key == shown_key:
+        fig_regime = Patch()
+        fig_regime['data'][1]['x'] = [values[x_name]]
+        fig_regime['data'][1]['y'] = [values[y_name]]
+        return fig_regime, key
+    
+    return (encode_figure(make_regime_fig(model_name, x_name, y_name, quantity,
+                                          apd0, params, theta, ts),
+                          figure_encodings['fig_regime']),
+            key)
+
+
+# Load fitted parameters from uploaded files
+@app.callback(
+            [
+          Output('fit_store','data'),
+          Output('fit_dropdown','options'),
+          Output('fit_dropdown','value'),
+            ],
+            Input('fit_upload','contents'),
+            State('fit_upload','filename'),
+            prevent_initial_call=True,
+            )
+
+@profile_callback
+def load_fits(contents, filenames):
+    
+    # Imported here as pandas is slow to import and only needed for uploads
+    import base64
+    import pandas as pd
+    from fitting import read_dataset, fit_table
+    
+    # Files with a model column are tables of fits. Other files are
+    # datasets, which are fitted here.
+    tables = []
+    names, datasets = [], []
+    for content, filename in zip(contents, filenames):
+        text = base64.b64decode(content.split(',', 1)[1]).decode('utf-8')
+        try:
+            table = pd.read_csv(io.StringIO(text))
+            if 'model' in table.columns:
+                tables.append(table)
+            else:
+                datasets.append(read_dataset(io.StringIO(text)))
+                names.append(os.path.splitext(filename)[0])
+        except (ValueError, pd.errors.ParserError):
+            continue
+    if datasets:
+        tables.append(fit_table(names, datasets))
+    if not tables:
+        raise PreventUpdate
+    
+    table = pd.concat(tables, ignore_index=True)
+    table = table[table['model'].isin(list(restitution_models))]
+    fits = table.astype(object).where(table.notna(), None).to_dict('records')
+    options = [{'label': '{} ({}, RMSE {:.1f} ms)'.format(
+                    fit['dataset'], fit['model'], fit['rmse']),
+                'value': i}
+               for i, fit in enumerate(fits)]
+    
+    return fits, options, None
+
+
+
+# Set the model and sliders to the selected fit
+@app.callback(
+            [Output('model_dropdown','value')] + 
+            [Output('{}_slider'.format(name),'value') for name in restitution_param_names],
+            Input('fit_dropdown','value'),
+            State('fit_store','data'),
+            prevent_initial_call=True,
+            )
+
+@profile_callback
+def load_fit(i, fits):
+    
+    if i is None:
+        raise PreventUpdate
+    fit = fits[i]
+    model = restitution_models[fit['model']]
+    values = [round(fit[name], 2) if name in model.param_names else dash.no_update
+              for name in restitution_param_names]
+    
+    return [fit['model']] + values
+
+
+# Latency and payload metrics of the callbacks, served on /metrics
+# (disable with COBWEB_METRICS=0)
+if os.environ.get('COBWEB_METRICS', '1') != '0':
+    callback_metrics = instrument_app(app)
+
+# Serve repeated figure callbacks from the shared cache (after the metrics
+# hooks, so that cache hits are timed)
+if result_cache is not None:
+    cache_responses(app, result_cache, {'update_restitution_fig', 'update_figs',
+                                        'update_bifurcation_fig', 'update_basin_fig',
+                                        'update_regime_fig'})
 
 
 #-----------------
 # Add the server clause
 #–-----------------
 if __name__ == '__main__':
-    app.run_server(
-        debug=True,
-        host='127.0.0.1',
-        )
+    
+    parser = argparse.ArgumentParser(description='Dash app for cobweb plot')
+    parser.add_argument('--build-defaults', action='store_true',
+                        help='Save the default figures to {} and exit'.format(path_defaults))
+    args = parser.parse_args()
+    
+    if args.build_defaults:
+        build_default_figures(figures=default_figures)
+        print('Saved default figures to {}'.format(path_defaults))
+    else:
+        app.run_server(
+            debug=True,
+            host='127.0.0.1',
+            )
 
 
 
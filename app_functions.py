@@ -6,98 +6,1295 @@ Created on Mon Aug 10 13:11:06 2020
 @author: tbury
 """
 
+import math
+import base64
+from functools import lru_cache
+
 import numpy as np
-import pandas as pd
 
-import plotly.express as px
 import plotly.graph_objects as go
 
 
 
 
 
+def restitution(di, apdmax, alpha, tau):
+    '''
+    Exponential restitution curve APD = g(DI) (Guevara et al. 1984)
+    '''
+    return apdmax - alpha*np.exp(-di/tau)
+
+
+
+def restitution_derivative(di, apdmax, alpha, tau):
+    '''
+    Derivative g'(DI) of the exponential restitution curve
+    '''
+    return alpha/tau*np.exp(-di/tau)
+
+
+
+def restitution_jacobian(di, apdmax, alpha, tau):
+    '''
+    Derivatives of the exponential restitution curve with respect to
+    (apdmax, alpha, tau)
+    '''
+    e = np.exp(-di/tau)
+    return np.ones_like(e), -e, -alpha*e*di/tau**2
+
+
+
+def restitution_sigmoid(di, a, b, x0):
+    '''
+    Sigmoid restitution curve APD = f(DI)
+    '''
+    return a/(1+np.exp(-(di-x0)/b))
+
+
+
+def restitution_sigmoid_derivative(di, a, b, x0):
+    '''
+    Derivative f'(DI) of the sigmoid restitution curve
+    '''
+    s = 1/(1+np.exp(-(di-x0)/b))
+    return a/b*s*(1-s)
+
+
+
+def restitution_sigmoid_jacobian(di, a, b, x0):
+    '''
+    Derivatives of the sigmoid restitution curve with respect to (a, b, x0)
+    '''
+    s = 1/(1+np.exp(-(di-x0)/b))
+    ds = a*s*(1-s)
+    return s, -ds*(di-x0)/b**2, -ds/b
+
+
+
+def _masked_linear_fit(x, y, mask):
+    '''
+    Least squares line y = c0 + c1*x for each row of x and y (2D arrays),
+    using the entries where mask is True. Returns c0, c1.
+    '''
+    n = np.maximum(mask.sum(axis=1), 1)
+    x_mean = np.where(mask, x, 0).sum(axis=1)/n
+    y_mean = np.where(mask, y, 0).sum(axis=1)/n
+    dx = np.where(mask, x - x_mean[:,None], 0)
+    dy = np.where(mask, y - y_mean[:,None], 0)
+    c1 = (dx*dy).sum(axis=1)/np.maximum((dx*dx).sum(axis=1), 1e-12)
+    return y_mean - c1*x_mean, c1
+
+
+
+#-----------------
+# Restitution models
+#-------------------
+
+class RestitutionModel:
+    '''
+    Interface for a restitution curve APD = f(DI, *params) used by the cobweb
+    map. The functions in this module that take a model work for any
+    subclass, so a new model only needs to define
+        name: key of the model in restitution_models
+        label: name of the model shown in the app
+        param_names: names of the parameters, in the order they are passed
+        evaluate(di, *params): the restitution curve
+        derivative(di, *params): its derivative with respect to DI
+        apd_sup(*params): an upper bound of the curve
+    evaluate and derivative must accept numpy arrays that broadcast against
+    each other for di and every parameter.
+    
+    Models that can be fitted to data (see fitting.py) also define
+        param_jacobian(di, *params): derivatives of the curve with respect
+            to each parameter
+        initial_guess(di, apd, mask): starting parameters for each row of
+            the 2D arrays di and apd, using the entries where mask is True
+    
+    The remaining attributes set how the model is shown in the figures.
+    '''
+    
+    name = None
+    label = None
+    param_names = ()
+    
+    # Symbol and LaTeX title of the restitution curve
+    symbol = 'f'
+    title = None
+    
+    # DI values at which the curve is sampled and APD range of the figure
+    di_range = (0, 300)
+    n_samples = 1000
+    apd_range = (0, 300)
+    
+    # Optional (DI, APD) data points shown with the curve
+    data = None
+    
+    def evaluate(self, di, *params):
+        raise NotImplementedError
+    
+    def evaluate_scalar(self, di, *params):
+        '''
+        evaluate for a single float DI, returning a float. Models can
+        override this with a faster version using the math module.
+        '''
+        return float(self.evaluate(di, *params))
+    
+    def derivative(self, di, *params):
+        raise NotImplementedError
+    
+    def apd_sup(self, *params):
+        raise NotImplementedError
+    
+    def param_jacobian(self, di, *params):
+        raise NotImplementedError
+    
+    def initial_guess(self, di, apd, mask):
+        raise NotImplementedError
+    
+    def sample_curve(self, *params):
+        '''
+        Sample the restitution curve for plotting. Memoized on the
+        parameters.
+        
+        Output:
+            x, y: read-only arrays
+        '''
+        return _sample_restitution_curve(self, params)
+    
+    def __repr__(self):
+        return '{}()'.format(type(self).__name__)
+
+
+
+class ExponentialModel(RestitutionModel):
+    '''
+    Exponential restitution curve of Guevara et al. (1984)
+    '''
+    
+    name = 'exponential'
+    label = 'Exponential (Guevara et al. 1984)'
+    param_names = ('apdmax', 'alpha', 'tau')
+    
+    symbol = 'g'
+    title = r'$\text{Restitution curve}\\ g(\text{DI})=\text{APD}_{\text{max}} - \alpha \exp^{-\frac{\text{DI}}{\tau}}$'
+    di_range = (0, 300)
+    n_samples = 1000
+    apd_range = (50, 250)
+    
+    # Data points from Ravi (SFU)
+    data = ([293.21, 153.69, 73.31, 42.60, 27.52],
+            [214.71, 189.54, 176.78, 156.91, 139.48])
+    
+    def evaluate(self, di, apdmax, alpha, tau):
+        return restitution(di, apdmax, alpha, tau)
+    
+    def evaluate_scalar(self, di, apdmax, alpha, tau):
+        try:
+            return apdmax - alpha*math.exp(-di/tau)
+        except (OverflowError, ZeroDivisionError):
+            return float(self.evaluate(di, apdmax, alpha, tau))
+    
+    def derivative(self, di, apdmax, alpha, tau):
+        return restitution_derivative(di, apdmax, alpha, tau)
+    
+    def apd_sup(self, apdmax, alpha, tau):
+        return apdmax
+    
+    def param_jacobian(self, di, apdmax, alpha, tau):
+        return restitution_jacobian(di, apdmax, alpha, tau)
+    
+    def initial_guess(self, di, apd, mask):
+        # Straight line fit of log(apdmax - APD) against DI, with apdmax
+        # just above the largest APD
+        apd_hi = np.where(mask, apd, -np.inf).max(axis=1)
+        apd_lo = np.where(mask, apd, np.inf).min(axis=1)
+        apdmax = apd_hi + 0.05*(apd_hi - apd_lo) + 1
+        c0, c1 = _masked_linear_fit(di, np.log(np.maximum(apdmax[:,None] - apd, 1e-6)), mask)
+        tau = np.where(c1 < 0, -1/np.minimum(c1, -1e-12), 100)
+        return np.stack([apdmax, np.exp(c0), np.clip(tau, 1, 1e4)], axis=1)
+
+
+
+class SigmoidModel(RestitutionModel):
+    '''
+    Sigmoid restitution curve
+    '''
+    
+    name = 'sigmoid'
+    label = 'Sigmoid'
+    param_names = ('a', 'b', 'x0')
+    
+    symbol = 'f'
+    title = r'$\text{Restitution curve}\\ f(\text{DI})=a/\left(1+e^{-(\text{DI}-x_0)/b}\right)$'
+    di_range = (-150, 400)
+    n_samples = 10000
+    apd_range = (0, 300)
+    
+    def evaluate(self, di, a, b, x0):
+        return restitution_sigmoid(di, a, b, x0)
+    
+    def evaluate_scalar(self, di, a, b, x0):
+        try:
+            return a/(1+math.exp(-(di-x0)/b))
+        except (OverflowError, ZeroDivisionError):
+            return float(self.evaluate(di, a, b, x0))
+    
+    def derivative(self, di, a, b, x0):
+        return restitution_sigmoid_derivative(di, a, b, x0)
+    
+    def apd_sup(self, a, b, x0):
+        return a
+    
+    def param_jacobian(self, di, a, b, x0):
+        return restitution_sigmoid_jacobian(di, a, b, x0)
+    
+    def initial_guess(self, di, apd, mask):
+        # Straight line fit of the logit of APD/a against DI, with a just
+        # above the largest APD
+        a = 1.05*np.where(mask, apd, -np.inf).max(axis=1)
+        p = np.clip(apd/a[:,None], 1e-6, 1-1e-6)
+        c0, c1 = _masked_linear_fit(di, np.log(p/(1-p)), mask)
+        b = np.clip(np.where(c1 > 0, 1/np.maximum(c1, 1e-12), 50), 1, 1e3)
+        return np.stack([a, b, -c0*b], axis=1)
+
+
+
+# Registry of restitution models by name
+restitution_models = {}
+
+
+def register_model(model):
+    '''
+    Add a restitution model (instance of a RestitutionModel subclass) to
+    the registry, which makes it available in the app
+    '''
+    restitution_models[model.name] = model
+    return model
+
+
+exponential_model = register_model(ExponentialModel())
+sigmoid_model = register_model(SigmoidModel())
+
+
+
+def beat_number(apd, theta, ts):
+    '''
+    Beat number N used by the cobweb map, i.e. the smallest N>=1 such that
+    N*ts - apd > theta. Computed in closed form so that apd, theta and ts
+    can be scalars or (broadcastable) numpy arrays.
+    '''
+    
+    apd = np.asarray(apd, dtype=float)
+    
+    # Closed form for smallest N with N*ts > apd + theta
+    N = np.maximum(np.floor((apd + theta)/ts), 0) + 1
+    
+    # Correct for rounding error in the division so that results agree
+    # exactly with the strict inequality N*ts - apd > theta
+    N += (N*ts - apd <= theta)
+    N -= (N > 1) & ((N-1)*ts - apd > theta)
+    
+    return N
+
+
+
+def cobweb_map_model(model, apd, params, theta, ts):
+    '''
+    Function for the cobweb map APD_{i+1} = f(N*ts - APD_i) of a
+    restitution model, with N the smallest beat number such that
+    N*ts - APD_i > theta.
+    
+    Input:
+        model: RestitutionModel
+        params: tuple of parameters of the model
+    
+    Accepts scalars or numpy arrays for apd, theta, ts and the parameters.
+    '''
+    
+    # Use smallest N such that N*t_s-apd > theta
+    arg = beat_number(apd, theta, ts)*ts - apd
+    
+    # Apply restitution curve
+    apd_next = model.evaluate(arg, *params)
+    
+    return apd_next
+
+
+
 def cobweb_map(apd, apdmax, alpha, tau, theta, ts):
     '''
     Function for the cobweb map APD_{i+1} = f(APD_i)
     As in Guevara et al. 1984
+    
+    Accepts scalars or numpy arrays for any of the arguments.
+    '''
+    return cobweb_map_model(exponential_model, apd, (apdmax, alpha, tau), theta, ts)
+
+
+
+def cobweb_map_sigmoid(apd, a, b, x0, theta, ts):
     '''
+    Function for the cobweb map APD_{i+1} = f(APD_i)
+    Using sigmoidal resitution curve
     
-    # Use smallest N such that N*t_s-apd > theta
-    args = np.arange(1,10)*ts - apd
-    arg = args[args > theta][0]
+    Accepts scalars or numpy arrays for any of the arguments.
+    '''
+    return cobweb_map_model(sigmoid_model, apd, (a, b, x0), theta, ts)
+
+
+
+def generate_cobweb_trajectory_model(model, nmax, apd0, params, theta, ts):
+    '''
+    Generate a cobweb trajectory by iterating the cobweb map of a model.
     
-    # Apply restitution curve
-    apd_next = apdmax - alpha*np.exp(-arg/tau)
+    Input:
+        model: RestitutionModel
+        nmax: number of iterations
+        apd0: initial condition
+        params: tuple of parameters of the model
+    '''
+    # Generate a phase trajectory (with the scalar map, as numpy is slow
+    # for single values)
+    cobweb_map_scalar = cobweb_map_scalar_model(model, params, theta, ts)
+    list_apd = []
+    apd=float(apd0)
+    list_apd.append(apd0)
+    for n in range(nmax):
+        apd = cobweb_map_scalar(apd)
+        list_apd.append(apd)
+
+    return list_apd
+
+
+
+def generate_cobweb_trajectory(nmax, apd0, apdmax, alpha, tau, theta, ts):
+    '''
+    Generate a cobweb trajectory by iterating the function cobweb_map.
+    
+    Input:
+        nmax: number of iterations
+        apd0: initial condition
+    '''
+    return generate_cobweb_trajectory_model(
+        exponential_model, nmax, apd0, (apdmax, alpha, tau), theta, ts)
+
+
+
+def generate_cobweb_trajectory_sigmoid(nmax, apd0, a, b, x0, theta, ts):
+    '''
+    Generate a cobweb trajectory by iterating the function cobweb_map.
+    
+    Input:
+        nmax: number of iterations
+        apd0: initial condition
+    '''
+    return generate_cobweb_trajectory_model(
+        sigmoid_model, nmax, apd0, (a, b, x0), theta, ts)
+
+
+
+def cobweb_map_scalar_model(model, params, theta, ts):
+    '''
+    The cobweb map of a model for fixed parameters, as a Python function of
+    a single float APD. Gives the same values as cobweb_map_model (up to
+    rounding in the exponential) without the overhead of numpy for scalars.
+    '''
+    
+    evaluate = model.evaluate_scalar
+    
+    def cobweb_map_scalar(apd):
+        if not math.isfinite(apd):
+            return float(cobweb_map_model(model, apd, params, theta, ts))
+        # Smallest N such that N*t_s-apd > theta, as in beat_number
+        N = max(math.floor((apd + theta)/ts), 0) + 1
+        if N*ts - apd <= theta:
+            N += 1
+        if N > 1 and (N-1)*ts - apd > theta:
+            N -= 1
+        return evaluate(N*ts - apd, *params)
+    
+    return cobweb_map_scalar
+
+
+
+def iterate_cobweb_trajectory_model(model, nmax, apd0, params, theta, ts,
+                                    chunk_size=2**16, max_period=64):
+    '''
+    Generate a cobweb trajectory of a model in chunks, for runs that are too
+    long to keep in memory. The map is iterated with
+    cobweb_map_scalar_model. At the end of each chunk, if the last APD is
+    exactly equal to one up to max_period iterations earlier, the trajectory
+    is periodic from then on (in floating point), and the remaining chunks
+    repeat the cycle instead of iterating the map. Chunks start at 1024
+    values and double up to chunk_size, so that a cycle is found soon after
+    the transient.
+    
+    Input:
+        model: RestitutionModel
+        nmax: number of iterations
+        apd0: initial condition
+        params: tuple of parameters of the model
+        chunk_size: maximum number of APD values per chunk
+        max_period: longest cycle that is detected
+    
+    Output:
+        generator of arrays of APD values, apd0 first and nmax+1 in total
+    '''
+    
+    cobweb_map_scalar = cobweb_map_scalar_model(model, params, theta, ts)
+    n_total = nmax + 1
+    n_done = 0
+    apd = float(apd0)
+    cycle = None
+    block = min(1024, chunk_size)
+    
+    while n_done < n_total:
+        n = min(chunk_size if cycle is not None else block, n_total - n_done)
+        block = min(2*block, chunk_size)
+        
+        # Repeat a cycle that started at index cycle_start
+        if cycle is not None:
+            yield cycle[(np.arange(n_done, n_done+n) - cycle_start) % len(cycle)]
+            n_done += n
+            continue
+        
+        list_apd = []
+        append = list_apd.append
+        if n_done == 0:
+            append(apd)
+        for i in range(n - len(list_apd)):
+            apd = cobweb_map_scalar(apd)
+            append(apd)
+        chunk = np.array(list_apd)
+        n_done += n
+        
+        # Look for the shortest period p with chunk[-1] == chunk[-1-p]
+        if n > max_period:
+            previous = chunk[-2:-2-max_period:-1]
+            periods = np.flatnonzero(previous == chunk[-1])
+            if periods.size:
+                p = periods[0] + 1
+                cycle = chunk[-p:].copy()
+                cycle_start = n_done
+        
+        yield chunk
+
+
+
+def _broadcast_flat(*arrays):
+    '''
+    Broadcast arrays against each other and flatten them.
+    Returns the broadcast shape and the flattened arrays.
+    '''
+    arrays = np.broadcast_arrays(*[np.asarray(p, dtype=float) for p in arrays])
+    return arrays[0].shape, [p.ravel() for p in arrays]
+
+
+
+def generate_cobweb_trajectories_batch_model(model, nmax, apd0, params, theta, ts):
+    '''
+    Generate many cobweb trajectories of a model at once. Each step of the
+    iteration is vectorized across all parameter sets.
+
+    Input:
+        model: RestitutionModel
+        nmax: number of iterations
+        apd0, theta, ts and the entries of params: scalars or arrays that
+            broadcast against each other. The broadcast shape is flattened
+            to give n_sets parameter combinations.
+
+    Output:
+        Array of shape (n_sets, nmax+1) with row i the trajectory of
+        parameter set i (column 0 is the initial condition)
+    '''
+
+    # Broadcast parameters and flatten to 1D
+    shape, (apd0, theta, ts, *params) = _broadcast_flat(apd0, theta, ts, *params)
+    n_sets = apd0.size
+
+    # Preallocate output. Fortran order keeps each time step contiguous.
+    apd_trajs = np.empty((n_sets, nmax+1), order='F')
+    apd_trajs[:,0] = apd0
+
+    for n in range(nmax):
+        apd_trajs[:,n+1] = cobweb_map_model(model, apd_trajs[:,n], params, theta, ts)
+
+    return apd_trajs
+
+
+
+def generate_cobweb_trajectories_batch(nmax, apd0, a, b, x0, theta, ts):
+    '''
+    Generate many cobweb trajectories of the sigmoid map at once.
+    See generate_cobweb_trajectories_batch_model.
+    '''
+    return generate_cobweb_trajectories_batch_model(
+        sigmoid_model, nmax, apd0, (a, b, x0), theta, ts)
+
+
+
+def find_cobweb_cycle_model(model, nmax, apd0, params, theta, ts,
+                            tol=1e-6, max_period=None):
+    '''
+    Iterate the cobweb map of a model until the trajectory settles on a fixed
+    point or period-k cycle, and stop early once it does.
+
+    Each APD is hashed by rounding to the tolerance and stored with the
+    index it last occurred at. A cycle is detected when a new APD lies within
+    tol of a stored one, and is accepted once it repeats (within tol) for
+    two more periods. Since an orbit converging to a fixed point with a
+    slope close to -1 looks like a period-2 cycle at any finite tolerance,
+    the limit of each point of the cycle is then estimated by Aitken
+    extrapolation and the period is reduced if these limits repeat.
+
+    Input:
+        model: RestitutionModel
+        nmax: maximum number of iterations
+        apd0: initial condition
+        params: tuple of parameters of the model
+        tol: tolerance (ms) for two APD values to be considered equal
+        max_period: largest period to detect (default no limit)
+
+    Output:
+        transient (list): APD values before the cycle
+        period (int): period of the cycle (0 if none detected in nmax)
+        cycle (list): APD values of one period of the cycle
+    '''
+
+    cobweb_map_scalar = cobweb_map_scalar_model(model, params, theta, ts)
+    list_apd = [apd0]
+    last_seen = {}
+
+    apd = float(apd0)
+    n_confirm = 0
+    period = 0
+    for n in range(nmax):
+
+        # Record previous state and iterate
+        last_seen[round(apd/tol)] = n
+        apd = cobweb_map_scalar(apd)
+        list_apd.append(apd)
+
+        if period:
+            # Confirm candidate cycle for two more periods
+            if abs(apd - list_apd[-1-period]) < tol:
+                n_confirm += 1
+                if n_confirm == 2*period:
+                    break
+                continue
+            period = 0
+
+        # Look for a previous state within tol (neighbouring bins included)
+        key = round(apd/tol)
+        matches = [last_seen[k] for k in (key-1, key, key+1)
+                   if k in last_seen and abs(apd - list_apd[last_seen[k]]) < tol]
+        if matches:
+            period = n + 1 - max(matches)
+            n_confirm = 0
+            if max_period and period > max_period:
+                period = 0
+
+    else:
+        # Cycle not found (or not confirmed) within nmax iterations
+        return list_apd, 0, []
+
+    # Estimate limit of each point of the cycle from its last three values
+    y0, y1, y2 = np.reshape(list_apd[-3*period:], (3, period))
+    denom = y2 - 2*y1 + y0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        apd_lim = np.where(np.abs(denom) > 0, y2 - (y2-y1)**2/denom, y2)
+
+    # Reduce to the smallest period consistent with the limits
+    for d in range(1, period):
+        if period % d == 0 and np.all(np.abs(apd_lim - np.roll(apd_lim, d)) < tol):
+            period = d
+            break
+
+    # Split trajectory into transient and one period of the cycle
+    n_start = len(list_apd) - 1 - period
+    while n_start >= period and abs(list_apd[n_start-period] - list_apd[n_start]) < tol:
+        n_start -= 1
+    transient = list_apd[:n_start]
+    cycle = list_apd[n_start:n_start+period]
+
+    return transient, period, cycle
+
+
+
+def find_cobweb_cycle_sigmoid(nmax, apd0, a, b, x0, theta, ts,
+                              tol=1e-6, max_period=None):
+    '''
+    Iterate the sigmoid cobweb map until the trajectory settles on a cycle.
+    See find_cobweb_cycle_model.
+    '''
+    return find_cobweb_cycle_model(sigmoid_model, nmax, apd0, (a, b, x0), theta, ts,
+                                   tol=tol, max_period=max_period)
+
+
+
+def classify_cycle(cycle, theta, ts):
+    '''
+    Label a cycle of the cobweb map by its stimulus:response ratio m:p,
+    where p is the period (number of action potentials) and m is the number
+    of stimuli delivered over the cycle.
+
+    Output:
+        label (str): e.g. '1:1', '2:2 alternans', '2:1 block'
+    '''
+
+    period = len(cycle)
+    if period == 0:
+        return 'No cycle detected'
+
+    m = int(np.sum(beat_number(cycle, theta, ts)))
+    label = '{}:{}'.format(m, period)
+
+    if m == period and period == 2:
+        label += ' alternans'
+    elif m > period:
+        label += ' block'
+
+    return label
+
+
+
+def _solve_fixed_points(f, fprime, params, apd_sup, theta, ts,
+                        n_branches=None, n_iter=100, tol=1e-10, xtol=1e-9):
+    '''
+    Find the fixed points APD* = f(N*ts - APD*) of each branch N of a cobweb
+    map, for many parameter sets at once.
+    
+    On branch N the map is defined for (N-1)*ts - theta <= APD < N*ts - theta
+    if N > 1, and for 0 <= APD < ts - theta if N = 1 (N is at least 1, so
+    with theta < 0 branch 1 also covers APD < -theta). On each branch
+    g(APD) = f(N*ts - APD) - APD is strictly decreasing, so it has at most
+    one fixed point. It is found by Newton's method safeguarded by bisection
+    on this bracket (restricted to APD >= 0), until |g| < tol or the bracket
+    is narrower than xtol.
+    
+    Input:
+        f, fprime: restitution curve and its derivative, called as f(di, *params)
+        params: tuple of restitution parameters
+        apd_sup: upper bound of the restitution curve (limits the branches)
+        n_branches: number of branches N=1,...,n_branches (default: all
+            branches that can contain a fixed point)
+    
+    Output:
+        apd_fp: fixed points, nan where a branch has none (or where the
+            iteration did not converge in n_iter steps)
+        slope: slope of the map -f'(N*ts - APD*) at the fixed point
+        stable: boolean array, True if |slope| < 1
+        All have shape (broadcast shape of parameters) + (n_branches,)
+    '''
+    
+    arrays = np.broadcast_arrays(*[np.asarray(p, dtype=float) for p in
+                                   (*params, apd_sup, theta, ts)])
+    *params, apd_sup, theta, ts = arrays
+    
+    if n_branches is None:
+        n_branches = int(np.max(np.floor((apd_sup + theta)/ts))) + 1
+        n_branches = max(n_branches, 1)
+    
+    # Add an axis for the branch number and flatten
+    N = np.arange(1, n_branches+1)
+    shape = theta.shape + (n_branches,)
+    params = [np.broadcast_to(p[...,None], shape).ravel() for p in params]
+    theta = np.broadcast_to(theta[...,None], shape).ravel()
+    ts = np.broadcast_to(ts[...,None], shape).ravel()
+    N = np.broadcast_to(N, shape).ravel()
+    
+    di_max = N*ts
+    
+    # Bracket of each branch
+    lo = np.where(N > 1, np.maximum((N-1)*ts - theta, 0), 0)
+    hi = N*ts - theta
+    has_root = hi > lo
+    has_root[has_root] = ((f(di_max - lo, *params)[has_root] - lo[has_root] >= 0)
+                          & (f(di_max - hi, *params)[has_root] - hi[has_root] < 0))
+    
+    # Iterate only on the branches that have not converged yet
+    apd = (lo + hi)/2
+    g_prev = np.full(apd.shape, np.inf)
+    active = np.flatnonzero(has_root)
+    for i in range(n_iter):
+        if active.size == 0:
+            break
+        pars = [p[active] for p in params]
+        x = apd[active]
+        gx = f(di_max[active] - x, *pars) - x
+        # Shrink bracket
+        width = hi[active] - lo[active]
+        lo_a = np.where(gx > 0, x, lo[active])
+        hi_a = np.where(gx > 0, hi[active], x)
+        lo[active] = lo_a
+        hi[active] = hi_a
+        converged = (np.abs(gx) < tol) | (hi_a - lo_a < xtol)
+        # Newton step (g' = -f' - 1 <= -1). Bisect if it leaves the bracket,
+        # or if the last step halved neither the bracket nor |g|, so that
+        # Newton steps that move very little cannot stall the iteration.
+        x_newton = x - gx/(-fprime(di_max[active] - x, *pars) - 1)
+        progress = (hi_a - lo_a <= width/2) | (np.abs(gx) <= np.abs(g_prev[active])/2)
+        x_new = np.where((x_newton > lo_a) & (x_newton < hi_a) & progress,
+                         x_newton, (lo_a + hi_a)/2)
+        g_prev[active] = gx
+        apd[active] = np.where(converged, x, x_new)
+        active = active[~converged]
+    
+    # Branches that did not converge have no fixed point found
+    has_root[active] = False
+    
+    slope = -fprime(di_max - apd, *params)
+    apd_fp = np.where(has_root, apd, np.nan).reshape(shape)
+    slope = np.where(has_root, slope, np.nan).reshape(shape)
+    stable = has_root.reshape(shape) & (np.abs(slope) < 1)
+    
+    return apd_fp, slope, stable
+
+
+
+def find_fixed_points_model(model, params, theta, ts, n_branches=None):
+    '''
+    Fixed points of each branch N of the cobweb map of a model, with their
+    slopes and stability. The parameters can be scalars or broadcastable
+    arrays. See _solve_fixed_points for the output.
+    '''
+    return _solve_fixed_points(model.evaluate, model.derivative, params,
+                               model.apd_sup(*params), theta, ts,
+                               n_branches=n_branches)
+
+
+
+def find_fixed_points(apdmax, alpha, tau, theta, ts, n_branches=None):
+    '''
+    Fixed points of each branch N of the cobweb map with the exponential
+    restitution curve, with their slopes and stability. Parameters can be
+    scalars or broadcastable arrays. See _solve_fixed_points for the output.
+    '''
+    return find_fixed_points_model(exponential_model, (apdmax, alpha, tau),
+                                   theta, ts, n_branches=n_branches)
+
+
+
+def find_fixed_points_sigmoid(a, b, x0, theta, ts, n_branches=None):
+    '''
+    Fixed points of each branch N of the cobweb map with the sigmoid
+    restitution curve, with their slopes and stability. Parameters can be
+    scalars or broadcastable arrays. See _solve_fixed_points for the output.
+    '''
+    return find_fixed_points_model(sigmoid_model, (a, b, x0),
+                                   theta, ts, n_branches=n_branches)
+
+
+
+def fixed_point_markers(apd_fp, stable):
+    '''
+    Coordinates and marker symbols to mark fixed points on the cobweb plot
+    (filled if stable, open if unstable)
+    '''
+    found = ~np.isnan(apd_fp)
+    x_fp = apd_fp[found]
+    symbols = np.where(stable[found], 'circle', 'circle-open')
+    
+    return x_fp.tolist(), symbols.tolist()
+
+
+
+def _extrapolate_cycles(model, apd_tail, params, theta, ts, p, tol=1e-3, n_steps=10):
+    '''
+    Period-p cycles that the tails of slowly converging trajectories tend
+    to, found by Steffensen's method (repeated Aitken extrapolation) on the
+    p-th iterate of the map, started from the last APD of each tail.
+    
+    A cycle is accepted if it repeats to within tol, is stable (multiplier
+    of modulus below 1), and the tail approaches it at least about as fast
+    as its multiplier predicts. The last check rejects trajectories that
+    settled on another attractor around an unstable or stable cycle, e.g.
+    alternans around the fixed point.
+    
+    Input:
+        apd_tail: array (n_sets, n_keep) of the last APD values
+        params, theta, ts: flat arrays (one value per set)
+    
+    Output:
+        found: boolean array, True where a cycle was accepted
+        cycle: array (n_sets, p), one period of the cycle ending at the
+            same phase as the tail (nan where not found)
+        n_stim: number of stimuli over one period of the cycle
+    '''
+    
+    def iterate(x):
+        # p-th iterate of the map, with the orbit and beat numbers
+        orbit = np.empty(x.shape + (p,))
+        N = np.zeros(x.shape)
+        log_mult = np.zeros(x.shape)
+        for j in range(p):
+            N_j = beat_number(x, theta, ts)
+            di = N_j*ts - x
+            log_mult += np.log(np.maximum(np.abs(model.derivative(di, *params)), 1e-300))
+            x = model.evaluate(di, *params)
+            orbit[:,j] = x
+            N += N_j
+        return x, orbit, N, log_mult
+    
+    x0 = apd_tail[:,-1].copy()
+    x = x0
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for i in range(n_steps):
+            x1 = iterate(x)[0]
+            x2 = iterate(x1)[0]
+            denom = x2 - 2*x1 + x
+            x_new = np.where(np.abs(denom) > 1e-300, x2 - (x2-x1)**2/denom, x2)
+            x_new = np.where(np.isfinite(x_new), x_new, x2)
+            if np.all(np.abs(x_new - x) < 1e-12):
+                x = x_new
+                break
+            x = x_new
+        x_p, orbit, N, log_mult = iterate(x)
+        
+        # Distance of the tail to the cycle at the same phase, m periods
+        # apart, and the distance expected from the multiplier
+        m = (apd_tail.shape[1] - 1)//p
+        d_end = np.abs(x0 - x)
+        d_start = np.abs(apd_tail[:,-1-m*p] - x)
+        decay = np.exp(m*log_mult)
+        found = ((np.abs(x_p - x) < tol) & (log_mult < 0)
+                 & ((d_end < tol) | (d_end < d_start*(1 + decay)/2)))
+    
+    # Cycle ending with the limit of the last APD of the tail (the orbit
+    # ends with the p-th iterate of it)
+    cycle = orbit
+    cycle[:,-1] = x
+    cycle[~found] = np.nan
+    
+    return found, cycle, N.astype(int)
+
+
+
+def classify_dynamics_batch_model(model, apd0, params, theta, ts, n_transient=500,
+                                  n_keep=64, tol=1e-3, max_period=16,
+                                  return_tail=False):
+    '''
+    Classify the long-term dynamics of the cobweb map of a model for many
+    parameter sets at once. All sets are iterated in lockstep, without
+    storing the transient.
+    
+    Input:
+        model: RestitutionModel
+        apd0, theta, ts and the entries of params: scalars or arrays that
+            broadcast against each other
+        n_transient: number of iterations discarded as transient
+        n_keep: number of iterations used for the classification
+            (should be at least 2*max_period)
+        tol: tolerance (ms) for detecting the period
+        max_period: largest period to detect
+    
+    Trajectories that converge slowly to a cycle with a multiplier close to
+    -1 (near a period doubling) still oscillate after the transient, and
+    would look like a cycle of twice the period, or none. As in
+    find_cobweb_cycle_model, the limit of the tail is extrapolated (see
+    _extrapolate_cycles): the period found is reduced if the tail tends to a
+    cycle of a divisor of the period, and trajectories without a period are
+    given the period of the cycle they tend to, if any. Tails that repeat
+    within tol while moving away from an unstable cycle (positive Lyapunov
+    exponent) are given period 0.
+    
+    Output (arrays with the broadcast shape of the parameters):
+        apd_final: APD after n_transient+n_keep iterations
+        period: period of the asymptotic cycle (0 if none up to max_period)
+        lyapunov: Lyapunov exponent, the mean of log|f'(DI)| over n_keep
+            iterations
+        n_stim: number of stimuli over one period of the cycle, so the
+            stimulus:response ratio is n_stim:period (0 if period is 0)
+        apd_tail: only if return_tail is True, the last n_keep APD values
+            (shape of the parameters + (n_keep,)). Where the cycle was
+            extrapolated, the last period values are those of the cycle.
+    '''
+    
+    shape, (apd, theta, ts, *params) = _broadcast_flat(apd0, theta, ts, *params)
+    n_sets = apd.size
+    
+    # Transient. Iterate in chunks and stop iterating parameter sets that
+    # have settled on a fixed point (to within rounding error).
+    apd = apd.copy()
+    active = np.arange(n_sets)
+    n_chunk = 32
+    for n in range(0, n_transient, n_chunk):
+        pars = [p[active] for p in params]
+        theta_active = theta[active]
+        ts_active = ts[active]
+        apd_active = apd[active]
+        for i in range(min(n_chunk, n_transient-n)):
+            apd_prev = apd_active
+            apd_active = cobweb_map_model(model, apd_active, pars,
+                                          theta_active, ts_active)
+        apd[active] = apd_active
+        active = active[np.abs(apd_active - apd_prev) > 1e-9]
+        if active.size == 0:
+            break
+    
+    # Keep APD values and beat numbers
+    apd_tail = np.empty((n_sets, n_keep+1), order='F')
+    N_tail = np.empty((n_sets, n_keep), order='F')
+    log_slope = np.zeros(n_sets)
+    apd_tail[:,0] = apd
+    for n in range(n_keep):
+        N = beat_number(apd, theta, ts)
+        di = N*ts - apd
+        apd = model.evaluate(di, *params)
+        slope = model.derivative(di, *params)
+        log_slope += np.log(np.maximum(slope, 1e-300))
+        apd_tail[:,n+1] = apd
+        N_tail[:,n] = N
+    lyapunov = log_slope/n_keep
+    
+    # Smallest period p such that the tail repeats with lag p
+    period = np.zeros(n_sets, dtype=int)
+    n_stim = np.zeros(n_sets, dtype=int)
+    for p in range(1, max_period+1):
+        undecided = period == 0
+        if not np.any(undecided) or 2*p > n_keep+1:
+            break
+        repeats = np.all(np.abs(apd_tail[undecided,p:] - apd_tail[undecided,:-p]) < tol,
+                         axis=1)
+        idx = np.flatnonzero(undecided)[repeats]
+        period[idx] = p
+        n_stim[idx] = np.sum(N_tail[idx,-p:], axis=1)
+    
+    # Tails that repeat within tol but move away from an unstable cycle
+    # (positive Lyapunov exponent) have not settled on it
+    period[lyapunov > 0] = 0
+    n_stim[lyapunov > 0] = 0
+    
+    # Trajectories that tend to a cycle of smaller period (a divisor of
+    # the period found), or to a cycle without repeating within tol yet.
+    # Only tails that contract at lag p in every phase are tried.
+    tail = apd_tail[:,1:]
+    for p in range(1, max_period+1):
+        if 2*p >= n_keep:
+            break
+        lag_end = np.abs(tail[:,-p:] - tail[:,-2*p:-p])
+        lag_start = np.abs(tail[:,p:2*p] - tail[:,:p])
+        candidate = (((period == 0) | ((period > p) & (period % p == 0)))
+                     & np.all(lag_end < lag_start, axis=1))
+        idx = np.flatnonzero(candidate)
+        if idx.size == 0:
+            continue
+        found, cycle, n_stim_p = _extrapolate_cycles(
+            model, tail[idx], [par[idx] for par in params], theta[idx], ts[idx], p, tol=tol)
+        idx = idx[found]
+        period[idx] = p
+        n_stim[idx] = n_stim_p[found]
+        apd_tail[idx,-p:] = cycle[found]
+    
+    output = (apd.reshape(shape), period.reshape(shape),
+              lyapunov.reshape(shape), n_stim.reshape(shape))
+    if return_tail:
+        output += (apd_tail[:,1:].reshape(shape + (n_keep,)),)
+    
+    return output
+
+
+
+def classify_dynamics_batch(apd0, a, b, x0, theta, ts, n_transient=500,
+                            n_keep=64, tol=1e-3, max_period=16,
+                            return_tail=False):
+    '''
+    Classify the long-term dynamics of the sigmoid map for many parameter
+    sets at once. See classify_dynamics_batch_model.
+    '''
+    return classify_dynamics_batch_model(
+        sigmoid_model, apd0, (a, b, x0), theta, ts, n_transient=n_transient,
+        n_keep=n_keep, tol=tol, max_period=max_period, return_tail=return_tail)
+
+
+
+# Maximum number of parameter sets to memoize curve samples for
+CURVE_CACHE_SIZE = 128
+
+
+def _read_only(*arrays):
+    '''
+    Mark arrays as read-only so that memoized results cannot be modified
+    in place by the caller.
+    '''
+    for arr in arrays:
+        arr.setflags(write=False)
+    return arrays
+
+
+
+def _sample_map_branches(f, params, theta, ts, apd_max=600, n_points=1000,
+                         n_pilot=256):
+    '''
+    Sample a cobweb map APD -> f(N*ts - APD) on [0, apd_max] for plotting.
+    
+    Each branch N is sampled separately between its breakpoints
+    APD = (N-1)*ts - theta and N*ts - theta (both ends included, using the
+    left limit at the upper end), with nan separating the branches. Within
+    a branch points are placed with density proportional to
+    sqrt(|curvature|) plus a uniform part, estimated on a pilot grid, which
+    keeps the error of linear interpolation roughly constant.
+    
+    Output:
+        xVals, yVals: arrays with about n_points samples
+    '''
+    
+    # Branch boundaries within [0, apd_max]
+    N_max = int(beat_number(apd_max, theta, ts))
+    breaks = np.arange(1, N_max)*ts - theta
+    edges = np.concatenate([[0], breaks[(breaks > 0) & (breaks < apd_max)], [apd_max]])
+    N_first = int(beat_number(0, theta, ts))
+    
+    # Curvature density of each branch on a pilot grid
+    x_pilot = []
+    dens_pilot = []
+    for k in range(len(edges)-1):
+        x = np.linspace(edges[k], edges[k+1], n_pilot)
+        y = f((N_first+k)*ts - x, *params)
+        curv = np.abs(np.gradient(np.gradient(y, x), x))
+        x_pilot.append(x)
+        dens_pilot.append(np.sqrt(curv))
+    
+    # Add a uniform density so flat parts of the map still get points
+    dens_uniform = np.mean(np.concatenate(dens_pilot)) + 1e-12
+    weights = []
+    for x, dens in zip(x_pilot, dens_pilot):
+        dens += 0.25*dens_uniform
+        cum = np.concatenate([[0], np.cumsum((dens[1:]+dens[:-1])/2*np.diff(x))])
+        weights.append(cum)
+    total = sum(cum[-1] for cum in weights)
+    
+    # Place samples by inverting the cumulative density of each branch
+    list_x = []
+    list_y = []
+    for k, (x, cum) in enumerate(zip(x_pilot, weights)):
+        n_branch = max(int(round(n_points*cum[-1]/total)), 8)
+        x_branch = np.interp(np.linspace(0, cum[-1], n_branch), cum, x)
+        x_branch[[0,-1]] = x[[0,-1]]
+        list_x.extend([x_branch, [np.nan]])
+        list_y.extend([f((N_first+k)*ts - x_branch, *params), [np.nan]])
+    
+    xVals = np.concatenate(list_x[:-1])
+    yVals = np.concatenate(list_y[:-1])
+    
+    return xVals, yVals
+
+
+
+@lru_cache(maxsize=CURVE_CACHE_SIZE)
+def sample_cobweb_map_model(model, params, theta, ts):
+    '''
+    Sample the cobweb map of a model for plotting, with nan at the
+    discontinuities. Memoized on the model and parameters.
+    
+    Output:
+        xVals, yVals: read-only arrays
+    '''
+    
+    xVals, yVals = _sample_map_branches(model.evaluate, params, theta, ts)
+    
+    return _read_only(xVals, yVals)
+
+
+
+@lru_cache(maxsize=CURVE_CACHE_SIZE)
+def _sample_restitution_curve(model, params):
+    # Memoized implementation of RestitutionModel.sample_curve
+    x = np.linspace(*model.di_range, model.n_samples)
+    y = model.evaluate(x, *params)
+    
+    return _read_only(x, y)
+
+
+
+def sample_cobweb_map(apdmax, alpha, tau, theta, ts):
+    '''
+    Sample the cobweb map for plotting, with nan at the discontinuities.
+    Memoized on the parameter tuple.
+    
+    Output:
+        xVals, yVals: read-only arrays
+    '''
+    return sample_cobweb_map_model(exponential_model, (apdmax, alpha, tau), theta, ts)
+
+
+
+def sample_cobweb_map_sigmoid(a, b, x0, theta, ts):
+    '''
+    Sample the cobweb map (sigmoid restitution curve) for plotting, with nan
+    at the discontinuities. Memoized on the parameter tuple.
+    
+    Output:
+        xVals, yVals: read-only arrays
+    '''
+    return sample_cobweb_map_model(sigmoid_model, (a, b, x0), theta, ts)
+
+
+
+def sample_restitution_curve(apdmax, alpha, tau):
+    '''
+    Sample the exponential restitution curve for plotting.
+    Memoized on the parameter tuple.
+    '''
+    return exponential_model.sample_curve(apdmax, alpha, tau)
+
+
+
+def sample_restitution_curve_sigmoid(a, b, x0):
+    '''
+    Sample the sigmoid restitution curve for plotting.
+    Memoized on the parameter tuple.
+    '''
+    return sigmoid_model.sample_curve(a, b, x0)
+
+
+
+def cobweb_staircase(apd_traj, compact=True, decimals=3):
+    '''
+    Put a trajectory in the form for plotting the lines of a cobweb plot,
+    i.e. (APD_0,0), (APD_0,APD_1), (APD_1,APD_1), (APD_1,APD_2), ...
+    
+    Once the trajectory settles on a cycle the staircase retraces the same
+    segments, so with compact=True a segment is dropped if it was already
+    drawn (in either direction, with its end points rounded to decimals),
+    and the line is broken with nan where segments were dropped. The plot
+    looks the same but long trajectories give few points.
+    
+    Output:
+        x_traj, y_traj: arrays of coordinates
+    '''
+    
+    apd = np.asarray(apd_traj, dtype=float)
+    x = np.repeat(apd, 2)[:-1]
+    y = np.concatenate([[0], np.repeat(apd[1:], 2)])
+    
+    n_seg = len(x) - 1
+    if not compact or n_seg < 2:
+        return x, y
+    
+    # End points of each segment, in a fixed order
+    ends = np.round(np.stack([x[:-1], y[:-1], x[1:], y[1:]], axis=1), decimals)
+    swap = (ends[:,0] > ends[:,2]) | ((ends[:,0] == ends[:,2]) & (ends[:,1] > ends[:,3]))
+    ends[swap] = ends[swap][:,[2,3,0,1]]
+    
+    # Keep the first occurrence of each segment
+    keep = np.zeros(n_seg, dtype=bool)
+    keep[np.unique(ends, axis=0, return_index=True)[1]] = True
+    if keep.all():
+        return x, y
+    
+    # Points at either end of a kept segment, with a break before each run
+    # of kept segments that follows dropped ones
+    include = np.zeros(n_seg+1, dtype=bool)
+    include[:-1] |= keep
+    include[1:] |= keep
+    idx = np.flatnonzero(include)
+    run_starts = np.flatnonzero(keep[1:] & ~keep[:-1]) + 1
+    breaks = np.searchsorted(idx, run_starts)
     
-    return apd_next
+    return np.insert(x[idx], breaks, np.nan), np.insert(y[idx], breaks, np.nan)
 
 
 
-def cobweb_map_sigmoid(apd, a, b, x0, theta, ts):
+#-----------------
+# Encoding of trace data
+#-------------------
+
+# Encodings of the arrays of trace data sent to the browser
+#   'json': unchanged, sent as a JSON list of numbers
+#   'round': rounded to ENCODING_DECIMALS decimal places, which shortens
+#       the JSON text
+#   'bdata': base64 typed array {'dtype', 'bdata'} as read by plotly.js
+#       (>= 2.28), with floats as float32
+ENCODINGS = ('json', 'round', 'bdata')
+ENCODING_DECIMALS = 2
+
+# Arrays shorter than this are not worth encoding
+ENCODING_MIN_SIZE = 32
+
+# Short names of the typed arrays of plotly.js
+_typed_array_dtypes = {'float32': 'f4', 'float64': 'f8', 'int8': 'i1', 'uint8': 'u1',
+                       'int16': 'i2', 'uint16': 'u2', 'int32': 'i4', 'uint32': 'u4'}
+
+
+def encode_array(values, encoding='json'):
     '''
-    Function for the cobweb map APD_{i+1} = f(APD_i)
-    Using sigmoidal resitution curve
+    Encode an array of trace data (list or numpy array) for sending to the
+    browser. Non-numeric arrays and short arrays are returned unchanged.
     '''
+    if encoding == 'json' or values is None:
+        return values
+    if encoding not in ENCODINGS:
+        raise ValueError('Unknown encoding {}'.format(encoding))
     
-    # Use smallest N such that N*t_s-apd > theta
-    args = np.arange(1,10)*ts - apd
-    arg = args[args > theta][0]
+    arr = np.asarray(values)
+    if arr.size < ENCODING_MIN_SIZE or arr.dtype.kind not in 'biuf':
+        return values
     
-    # Apply restitution curve
-    apd_next = a/(1+np.exp(-(arg-x0)/b))
+    if encoding == 'round':
+        return np.round(arr.astype(float), ENCODING_DECIMALS).tolist()
     
-    return apd_next
+    # Typed array, with floats as float32 and integers as int32
+    if arr.dtype.kind == 'f':
+        arr = arr.astype('<f4')
+    elif arr.dtype.itemsize > 4 or arr.dtype.kind == 'b':
+        arr = arr.astype('<i4')
+    arr = np.ascontiguousarray(arr)
+    spec = {'dtype': _typed_array_dtypes[arr.dtype.name],
+            'bdata': base64.b64encode(arr.tobytes()).decode('ascii')}
+    if arr.ndim > 1:
+        spec['shape'] = ','.join(map(str, arr.shape))
+    return spec
 
 
 
-def generate_cobweb_trajectory(nmax, apd0, apdmax, alpha, tau, theta, ts):
+def decode_typed_array(spec):
     '''
-    Generate a cobweb trajectory by iterating the function cobweb_map.
-    
-    Input:
-        nmax: number of iterations
-        apd0: initial condition
+    Numpy array from a typed array spec {'dtype', 'bdata', 'shape'}, as made
+    by encode_array (or by plotly.py >= 6 when it serializes numpy arrays)
     '''
-    # Generate a phase trajectory
-    list_apd = []
-    apd=apd0
-    list_apd.append(apd0)
-    for n in range(nmax):
-        apd = cobweb_map(apd, apdmax, alpha, tau, theta, ts)
-        list_apd.append(apd)
-
-    return list_apd
+    dtypes = {short: name for name, short in _typed_array_dtypes.items()}
+    arr = np.frombuffer(base64.b64decode(spec['bdata']),
+                        dtype=np.dtype(dtypes[spec['dtype']]).newbyteorder('<'))
+    if 'shape' in spec:
+        arr = arr.reshape([int(n) for n in str(spec['shape']).split(',')])
+    return arr
 
 
 
-def generate_cobweb_trajectory_sigmoid(nmax, apd0, a, b, x0, theta, ts):
+def encode_figure(fig, encoding='json'):
     '''
-    Generate a cobweb trajectory by iterating the function cobweb_map.
-    
-    Input:
-        nmax: number of iterations
-        apd0: initial condition
+    Encode the x, y and z arrays of all traces of a figure (plotly Figure
+    or dict). Returns the figure as a dict.
     '''
-    # Generate a phase trajectory
-    list_apd = []
-    apd=apd0
-    list_apd.append(apd0)
-    for n in range(nmax):
-        apd = cobweb_map_sigmoid(apd, a, b, x0, theta, ts)
-        list_apd.append(apd)
+    if not isinstance(fig, dict):
+        fig = fig.to_plotly_json()
+    if encoding == 'json':
+        return fig
+    
+    data = []
+    for trace in fig.get('data', []):
+        trace = dict(trace)
+        for key in ('x', 'y', 'z'):
+            values = trace.get(key)
+            if isinstance(values, dict) and 'bdata' in values:
+                values = decode_typed_array(values)
+            if isinstance(values, (list, tuple, np.ndarray)):
+                trace[key] = encode_array(values, encoding)
+        data.append(trace)
+    
+    return dict(fig, data=data)
 
-    return list_apd
 
 
-def make_cobweb_fig(apdmax, alpha, tau, theta, ts,
-                    apd_traj,
-                    ):
+def make_cobweb_fig_model(model, params, theta, ts, apd_traj):
     '''
     Make cobweb map of model (draw lines connecting subsequent states)
     Plot the trajectory that is converged to.
     
     Input:
-        cobweb_map: function phi_{i+1} = f(phi_{i})
+        model: RestitutionModel
+        params: tuple of parameters of the model
         apd_traj (list): trajectory of apd values
         
     Ouptut:
@@ -105,20 +1302,14 @@ def make_cobweb_fig(apdmax, alpha, tau, theta, ts,
     '''
 
     # Create values for plot of phase map
-    xVals = np.linspace(0,600,10000)
-    yVals = np.array([cobweb_map(x, apdmax, alpha, tau, theta, ts) for x in xVals])
-    # # Insert nan at discontinuities
-    pos = np.where(np.abs(np.diff(yVals)) >= 1)[0]
-    xVals[pos] = np.nan
-    yVals[pos] = np.nan
+    xVals, yVals = sample_cobweb_map_model(model, tuple(params), theta, ts)
+    
+    # Fixed points of each branch of the map
+    apd_fp, slope, stable = find_fixed_points_model(model, params, theta, ts)
+    x_fp, symbols_fp = fixed_point_markers(apd_fp, stable)
     
     # Collect apd data and put in form for plotting lines
-    apd_traj_plot = []
-    # First line
-    apd_traj_plot.append((apd_traj[0],0))
-    for i in range(len(apd_traj)-1):
-        apd_traj_plot.append((apd_traj[i],apd_traj[i+1]))
-        apd_traj_plot.append((apd_traj[i+1],apd_traj[i+1]))
+    x_traj, y_traj = cobweb_staircase(apd_traj)
 
 
     fig = go.Figure()
@@ -144,13 +1335,24 @@ def make_cobweb_fig(apdmax, alpha, tau, theta, ts,
     
     # Trace for phase trajectory
     fig.add_trace(
-        go.Scatter(x=[tup[0] for tup in apd_traj_plot],
-                   y=[tup[1] for tup in apd_traj_plot],
+        go.Scatter(x=x_traj,
+                   y=y_traj,
+                   mode='lines',
                    showlegend=False,
                    line={'color':'royalblue'},
         )
     )
     
+    # Trace for fixed points
+    fig.add_trace(
+        go.Scatter(x=x_fp,
+                   y=x_fp,
+                   showlegend=False,
+                   mode='markers',
+                   marker={'color':'crimson', 'size':9, 'symbol':symbols_fp},
+        )
+    )
+    
     
     fig.update_xaxes(
         range=[0,250],
@@ -165,196 +1367,535 @@ def make_cobweb_fig(apdmax, alpha, tau, theta, ts,
     fig.update_layout(
         # width=500, height=500,
         margin=dict(l=50,r=10,t=100,b=10),
-        title=r'$\text{Cobweb plot}\\ \text{APD}_{i+1} = g(Nt_s-\text{APD}_i)$',
+        title=r'$\text{Cobweb plot}\\ \text{APD}_{i+1} = %s(Nt_s-\text{APD}_i)$' % model.symbol,
         )
        
     return fig
 
 
 
+def make_cobweb_fig(apdmax, alpha, tau, theta, ts,
+                    apd_traj,
+                    ):
+    '''
+    Make cobweb map of the exponential model. See make_cobweb_fig_model.
+    '''
+    return make_cobweb_fig_model(exponential_model, (apdmax, alpha, tau),
+                                 theta, ts, apd_traj)
+
+
+
 def make_cobweb_fig_sigmoid(a, b, x0, theta, ts,
                             apd_traj,
                     ):
     '''
-    Make cobweb map of model (draw lines connecting subsequent states)
-    Plot the trajectory that is converged to.
-    
-    Input:
-        cobweb_map: function phi_{i+1} = f(phi_{i})
-        apd_traj (list): trajectory of apd values
-        
-    Ouptut:
-        Plotly figure of map and stable trajectory
+    Make cobweb map of the sigmoid model. See make_cobweb_fig_model.
     '''
+    return make_cobweb_fig_model(sigmoid_model, (a, b, x0),
+                                 theta, ts, apd_traj)
 
-    # Create values for plot of phase map
-    xVals = np.linspace(0,600,10000)
-    yVals = np.array([cobweb_map_sigmoid(x, a, b, x0, theta, ts) for x in xVals])
-    # # Insert nan at discontinuities
-    pos = np.where(np.abs(np.diff(yVals)) >= 1)[0]
-    xVals[pos] = np.nan
-    yVals[pos] = np.nan
-    
-    # Collect apd data and put in form for plotting lines
-    apd_traj_plot = []
-    # First line
-    apd_traj_plot.append((apd_traj[0],0))
-    for i in range(len(apd_traj)-1):
-        apd_traj_plot.append((apd_traj[i],apd_traj[i+1]))
-        apd_traj_plot.append((apd_traj[i+1],apd_traj[i+1]))
 
 
-    fig = go.Figure()
+def make_restitution_fig_model(model, params):
+    '''
+    Make figure of the restitution curve of a model, with the data points
+    of the model if it has any
+    '''
     
-    # Trace for phase map
-    fig.add_trace(
-        go.Scatter(x=xVals,
-                   y=yVals,
-                   showlegend=False,
-                   line={'color':'black'},
-        )
-    )
+    # Restitution curve
+    x, y = model.sample_curve(*params)
     
-    # Trace for line y=x
+    fig = go.Figure()
     fig.add_trace(
-        go.Scatter(x=np.linspace(0,600,1000),
-                   y=np.linspace(0,600,1000),
-                   line={'dash':'dash',
-                         'color':'gray'},
+        go.Scatter(x=x, y=y,
                    showlegend=False,
-        )
+                   mode='lines',
+                   )
     )
-    
-    # Trace for phase trajectory
-    fig.add_trace(
-        go.Scatter(x=[tup[0] for tup in apd_traj_plot],
-                   y=[tup[1] for tup in apd_traj_plot],
-                   showlegend=False,
-                   line={'color':'royalblue'},
+    if model.data is not None:
+        x_data, y_data = model.data
+        fig.add_trace(
+            go.Scatter(x=x_data, y=y_data,
+                       showlegend=False,
+                       mode='markers',
+                       )
         )
-    )
-    
-    
-    fig.update_xaxes(
-        range=[0,250],
-        title=r'$\text{APD}_{i} \text{ (ms)}$',
-    )
-    
-    fig.update_yaxes(
-        range=[0,250],
-        title=r'$\text{APD}_{i+1} \text{ (ms)}$',
-    )
+    fig.update_xaxes(title = r'$\text{DI (ms)}$', range=list(model.di_range))
+    fig.update_yaxes(title = r'$\text{APD (ms)}$', range=list(model.apd_range))
     
     fig.update_layout(
         # width=500, height=500,
         margin=dict(l=50,r=10,t=100,b=10),
-        title=r'$\text{Cobweb plot}\\ \text{APD}_{i+1} = f(Nt_s-\text{APD}_i)$',
+        title=model.title,
         )
-       
+    
     return fig
 
 
 
 def make_restitution_fig(apdmax, alpha, tau):
+    return make_restitution_fig_model(exponential_model, (apdmax, alpha, tau))
+
+
+
+def make_restitution_fig_sigmoid(a, b, x0):
+    return make_restitution_fig_model(sigmoid_model, (a, b, x0))
+
+
+
+
+class MinMaxDownsampler:
+    '''
+    Downsample a sequence of n_total values, given in chunks, to the minimum
+    and maximum of each of n_buckets buckets of consecutive values (in the
+    order they occur). A line through these points looks the same as one
+    through all values at the width of a plot with about n_buckets pixels,
+    since every peak and trough is kept. Only a partial bucket is stored
+    between chunks.
+    '''
     
-    # Data points from Ravi (SFU)
-    x_data = [293.21, 153.69, 73.31, 42.60, 27.52]
-    y_data = [214.71, 189.54, 176.78, 156.91, 139.48]
+    def __init__(self, n_total, n_buckets=2000):
+        self.width = max(1, -(-n_total//n_buckets))
+        self.n_seen = 0
+        self.rest = np.empty(0)
+        self.x = []
+        self.y = []
     
+    def _add_buckets(self, values, start):
+        # Minimum and maximum of each row of values (one bucket per row)
+        i_min = values.argmin(axis=1)
+        i_max = values.argmax(axis=1)
+        first = np.minimum(i_min, i_max)
+        second = np.maximum(i_min, i_max)
+        idx = np.stack([first, second], axis=1)
+        keep = np.ones(idx.shape, dtype=bool)
+        keep[:,1] = second != first
+        rows = np.arange(len(values))[:,None]
+        offsets = start + rows*values.shape[1]
+        self.x.append((offsets + idx)[keep])
+        self.y.append(values[rows, idx][keep])
     
+    def update(self, chunk):
+        values = np.concatenate([self.rest, np.asarray(chunk, dtype=float)])
+        start = self.n_seen - len(self.rest)
+        n_full = len(values)//self.width
+        if n_full:
+            self._add_buckets(values[:n_full*self.width].reshape(n_full, self.width), start)
+        self.rest = values[n_full*self.width:]
+        self.n_seen += len(chunk)
     
-    # Restitution curve
-    x = np.linspace(0,300,1000)
-    y = apdmax - alpha * np.exp(-x/tau)
+    def result(self):
+        '''
+        Indices and values of the points kept
+        '''
+        if len(self.rest):
+            self._add_buckets(self.rest[None,:], self.n_seen - len(self.rest))
+            self.rest = np.empty(0)
+        if not self.x:
+            return np.empty(0, dtype=int), np.empty(0)
+        return np.concatenate(self.x), np.concatenate(self.y)
+
+
+
+def downsample_cobweb_trajectory_model(model, nmax, apd0, params, theta, ts,
+                                       n_buckets=2000):
+    '''
+    Iterate the cobweb map of a model nmax times and downsample the
+    trajectory with MinMaxDownsampler, in memory bounded by the chunk size
+    of iterate_cobweb_trajectory_model.
+    
+    Output:
+        beats: iteration numbers of the points kept
+        apd: their APD values
+    '''
+    downsampler = MinMaxDownsampler(nmax+1, n_buckets)
+    for chunk in iterate_cobweb_trajectory_model(model, nmax, apd0, params, theta, ts):
+        downsampler.update(chunk)
+    return downsampler.result()
+
+
+
+def make_apd_sequence(apd_traj, beats=None):
+    '''
+    Figure of the APD sequence. For a downsampled trajectory pass the
+    iteration numbers of the points as beats, and they are joined by lines
+    without markers.
+    '''
     
+    x = np.arange(len(apd_traj)) if beats is None else beats
+    y = apd_traj
+
     fig = go.Figure()
     fig.add_trace(
         go.Scatter(x=x, y=y,
                    showlegend=False,
-                   mode='lines',
+                   mode='markers+lines' if beats is None else 'lines',
                    )
     )
+    fig.update_xaxes(title = r'$\text{Iteration}$',)
+    fig.update_yaxes(title = r'$\text{APD (ms)}$',range=[0,500])
+    
+    fig.update_layout(
+        height=300,
+        margin=dict(l=50,r=10,t=30,b=10),
+        title=r'$\text{APD sequence}$',
+        )
+    
+    return fig
+
+
+
+def compute_bifurcation_data_model(model, apd0, params, theta, ts_vals,
+                                   n_transient=200, n_keep=30, tol=0.05):
+    '''
+    Compute the asymptotic APD values of the cobweb map of a model over a
+    range of pacing periods. All values of ts are iterated together using
+    generate_cobweb_trajectories_batch_model.
+
+    Input:
+        model: RestitutionModel
+        params: tuple of parameters of the model
+        ts_vals: array of pacing periods
+        n_transient: number of iterations discarded as transient
+        n_keep: number of iterations kept after the transient
+        tol: APD values at the same ts closer than tol are only kept once
+
+    Output:
+        ts_plot, apd_plot: arrays of points for the bifurcation diagram
+    '''
+
+    ts_vals = np.asarray(ts_vals, dtype=float)
+    apd_trajs = generate_cobweb_trajectories_batch_model(
+        model, n_transient+n_keep, apd0, params, theta, ts_vals)
+
+    return bifurcation_points(ts_vals, apd_trajs[:,n_transient+1:], tol=tol)
+
+
+
+def compute_bifurcation_data(apd0, a, b, x0, theta, ts_vals,
+                             n_transient=200, n_keep=30, tol=0.05):
+    '''
+    Compute the asymptotic APD values of the sigmoid map over a range of
+    pacing periods. See compute_bifurcation_data_model.
+    '''
+    return compute_bifurcation_data_model(
+        sigmoid_model, apd0, (a, b, x0), theta, ts_vals,
+        n_transient=n_transient, n_keep=n_keep, tol=tol)
+
+
+
+def bifurcation_points(ts_vals, apd_asym, tol=0.05):
+    '''
+    Points of the bifurcation diagram from the asymptotic APD values
+    apd_asym (shape (len(ts_vals), n_keep)), keeping values at the same ts
+    that are closer than tol only once.
+    '''
+
+    # Sort so duplicates at each ts are adjacent
+    apd_asym = np.sort(apd_asym, axis=1)
+    keep = np.ones(apd_asym.shape, dtype=bool)
+    keep[:,1:] = np.diff(apd_asym, axis=1) > tol
+
+    ts_plot = np.broadcast_to(np.asarray(ts_vals)[:,None], apd_asym.shape)[keep]
+    apd_plot = apd_asym[keep]
+
+    return ts_plot, apd_plot
+
+
+
+def make_bifurcation_fig(ts_plot, apd_plot, ts):
+    '''
+    Make bifurcation diagram of asymptotic APD against pacing period,
+    with a vertical line marking the current value of ts.
+
+    Input:
+        ts_plot, apd_plot: output of compute_bifurcation_data
+        ts: current pacing period
+    '''
+
+    fig = go.Figure()
     fig.add_trace(
-        go.Scatter(x=x_data, y=y_data,
-                   showlegend=False,
-                   mode='markers',
-                   )
+        go.Scattergl(x=ts_plot, y=apd_plot,
+                     showlegend=False,
+                     mode='markers',
+                     marker={'size':3, 'color':'black'},
+                     )
     )
-    fig.update_xaxes(title = r'$\text{DI (ms)}$', range=[0,300])
-    fig.update_yaxes(title = r'$\text{APD (ms)}$', range=[50,250])
-    
+    fig.add_vline(x=ts, line={'dash':'dash', 'color':'royalblue'})
+
+    fig.update_xaxes(title = r'$t_s \text{ (ms)}$',)
+    fig.update_yaxes(title = r'$\text{APD (ms)}$', range=[0,300])
+
     fig.update_layout(
-        # width=500, height=500,
-        margin=dict(l=50,r=10,t=100,b=10),
-        title=r'$\text{Restitution curve}\\ g(\text{DI})=\text{APD}_{\text{max}} - \alpha \exp^{-\frac{\text{DI}}{\tau}}$',
+        height=300,
+        margin=dict(l=50,r=10,t=30,b=10),
+        title=r'$\text{Bifurcation diagram}$',
         )
+
+    return fig
+
+
+
+def compute_basins_model(model, apd0_vals, params, theta, ts, resolution=1,
+                         n_transient=500, n_keep=32, max_period=16,
+                         n_extend=5):
+    '''
+    Assign each initial condition APD_0 of a grid to the attractor of the
+    cobweb map of a model that its trajectory settles on. All initial
+    conditions are iterated together by classify_dynamics_batch_model.
+    Attractors are identified by their period and the smallest APD of their
+    cycle: sorted by these, trajectories of the same period whose smallest
+    APD differ by at most resolution (one after the other) are put on the
+    same attractor, so that slowly converging trajectories are not taken as
+    separate attractors. Trajectories without a cycle whose tail repeats to
+    within resolution are still leaving an unstable cycle slowly, e.g. near
+    a period doubling, and are iterated further, with transients of twice
+    the length each time, up to n_extend times. Initial conditions still
+    without a cycle up to max_period are assigned to one attractor with
+    period 0.
+    
+    Input:
+        model: RestitutionModel
+        apd0_vals: array of initial conditions
+        params: tuple of parameters of the model
+        resolution: largest gap (ms) between the smallest APD of the cycles
+            of trajectories on one attractor
+        n_transient, n_keep, max_period: see classify_dynamics_batch_model
+        n_extend: largest number of further transients of slow trajectories
+    
+    Output:
+        labels: index of the attractor of each initial condition
+        attractors: list of cycles (arrays of the APD values over one
+            period, starting from the smallest), sorted by period and APD.
+            The cycle is empty for period 0.
+    '''
+    
+    apd0_vals = np.asarray(apd0_vals, dtype=float)
+    apd_final, period, lyapunov, n_stim, apd_tail = classify_dynamics_batch_model(
+        model, apd0_vals, params, theta, ts, n_transient=n_transient,
+        n_keep=n_keep, max_period=max_period, return_tail=True)
+    
+    for i in range(n_extend):
+        undecided = np.flatnonzero(period == 0)
+        tail = apd_tail[undecided]
+        slow = np.zeros(len(undecided), dtype=bool)
+        for p in range(1, min(max_period, n_keep//2) + 1):
+            near = np.flatnonzero(np.abs(tail[:,-1] - tail[:,-1-p]) < resolution)
+            slow[near] |= np.all(np.abs(tail[near,p:] - tail[near,:-p]) < resolution, axis=1)
+        slow = undecided[slow]
+        if slow.size == 0:
+            break
+        (apd_final[slow], period[slow], lyapunov[slow], n_stim[slow],
+         apd_tail[slow]) = classify_dynamics_batch_model(
+            model, apd_final[slow], params, theta, ts, n_transient=n_transient*2**(i+1),
+            n_keep=n_keep, max_period=max_period, return_tail=True)
+    
+    # Smallest APD over the last period of each trajectory
+    apd_min = np.zeros(len(apd0_vals))
+    for p in np.unique(period[period > 0]):
+        rows = period == p
+        apd_min[rows] = apd_tail[rows,-p:].min(axis=1)
     
-    return fig    
+    # Group trajectories sorted by period and smallest APD at gaps
+    order = np.lexsort((apd_min, period))
+    new = np.concatenate([[True], (np.diff(period[order]) != 0) |
+                          (np.diff(apd_min[order]) > resolution)])
+    labels = np.empty(len(apd0_vals), dtype=int)
+    labels[order] = np.cumsum(new) - 1
+    
+    # Cycle of each attractor, from its trajectory with the median APD
+    attractors = []
+    bounds = np.append(np.flatnonzero(new), len(order))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        i = order[(start + end)//2]
+        p = period[i]
+        cycle = apd_tail[i,-p:] if p > 0 else np.empty(0)
+        attractors.append(np.roll(cycle, -int(np.argmin(cycle))) if p > 0 else cycle)
+    
+    return labels, attractors
 
 
 
-def make_restitution_fig_sigmoid(a, b, x0):
+def label_runs(labels):
+    '''
+    Compress an array of labels into runs of equal labels
+    
+    Output:
+        starts: index of the first element of each run
+        run_labels: label of each run
+    '''
+    labels = np.asarray(labels)
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(labels)) + 1])
+    return starts, labels[starts]
+
+
+
+def make_basin_fig(apd0_vals, labels, attractors, theta, ts, apd0_current=None):
+    '''
+    Make a strip of the basins of attraction over APD_0, colored by the
+    attractor, with a vertical line at the current APD_0.
+    
+    Input:
+        apd0_vals: increasing array of initial conditions
+        labels, attractors: output of compute_basins_model
+        apd0_current: current initial condition
+    '''
     
-    # # Data points from Ravi (SFU)
-    # x_data = [293.21, 153.69, 73.31, 42.60, 27.52]
-    # y_data = [214.71, 189.54, 176.78, 156.91, 139.48]
+    apd0_vals = np.asarray(apd0_vals, dtype=float)
+    starts, run_labels = label_runs(labels)
     
+    # Edges of the runs, halfway between the grid points on either side
+    edges = np.concatenate([apd0_vals[:1],
+                            (apd0_vals[starts[1:]-1] + apd0_vals[starts[1:]])/2,
+                            apd0_vals[-1:]])
     
+    # Discrete colors, one per attractor
+    palette = ['#636efa', '#EF553B', '#00cc96', '#ab63fa', '#FFA15A',
+               '#19d3f3', '#FF6692', '#B6E880', '#FF97FF', '#FECB52']
+    n = len(attractors)
+    colors = [palette[i % len(palette)] for i in range(n)]
+    colorscale = []
+    for i, color in enumerate(colors):
+        colorscale += [[i/n, color], [(i+1)/n, color]]
     
-    # Restitution curve
-    x = np.linspace(-150,400,10000)
-    y = a/(1+np.exp(-(x-x0)/b))
+    names = []
+    for cycle in attractors:
+        if len(cycle) == 0:
+            names.append('No cycle')
+        else:
+            names.append('{}: APD {} ms'.format(
+                classify_cycle(cycle, theta, ts),
+                ', '.join('{:.1f}'.format(apd) for apd in cycle)))
     
     fig = go.Figure()
     fig.add_trace(
-        go.Scatter(x=x, y=y,
-                   showlegend=False,
-                   mode='lines',
+        go.Heatmap(x=edges, y=[0, 1], z=[run_labels],
+                   text=[[names[i] for i in run_labels]],
+                   hovertemplate='%{text}<extra></extra>',
+                   colorscale=colorscale, zmin=-0.5, zmax=n-0.5,
+                   showscale=False,
                    )
     )
-    # fig.add_trace(
-    #     go.Scatter(x=x_data, y=y_data,
-    #                showlegend=False,
-    #                mode='markers',
-    #                )
-    # )
-    fig.update_xaxes(title = r'$\text{DI (ms)}$', range=[-150,400])
-    fig.update_yaxes(title = r'$\text{APD (ms)}$', range=[0,300])
+    
+    # Legend entries for the attractors
+    for name, color in zip(names, colors):
+        fig.add_trace(
+            go.Scatter(x=[None], y=[None],
+                       mode='markers',
+                       marker={'symbol':'square', 'size':10, 'color':color},
+                       name=name,
+                       )
+        )
+    
+    if apd0_current is None:
+        apd0_current = apd0_vals[0]
+    fig.add_vline(x=apd0_current, line={'dash':'dash', 'color':'black'})
+    
+    fig.update_xaxes(title = r'$\text{APD}_0 \text{ (ms)}$',
+                     range=[apd0_vals[0], apd0_vals[-1]])
+    fig.update_yaxes(visible=False, range=[0, 1])
     
     fig.update_layout(
-        # width=500, height=500,
-        margin=dict(l=50,r=10,t=100,b=10),
-        title=r'$\text{Restitution curve}\\ f(\text{DI})=a/\left(1+e^{-(\text{DI}-x_0)/b}\right)$',
+        height=180,
+        margin=dict(l=50,r=10,t=50,b=45),
+        title=r'$\text{Basins of attraction}$',
+        legend={'orientation':'h', 'x':1, 'xanchor':'right', 'y':1.05,
+                'yanchor':'bottom', 'font':{'size':10}},
         )
     
     return fig
 
 
 
-
-def make_apd_sequence(apd_traj):
+def compute_regime_map(params, x_name, x_vals, y_name, y_vals, model=sigmoid_model,
+                       **kwargs):
+    '''
+    Classify the long-term dynamics of the cobweb map of a model over a 2D
+    grid of two parameters, with the other parameters held fixed.
     
-    x = np.arange(len(apd_traj))
-    y = apd_traj
+    Input:
+        params: dict of parameter values with keys apd0, theta, ts and the
+            parameter names of the model
+        x_name, y_name: names of the parameters varied along each axis
+        x_vals, y_vals: values of these parameters
+        model: RestitutionModel (default the sigmoid model)
+        kwargs: passed to classify_dynamics_batch_model
+    
+    Output:
+        period, lyapunov, n_stim: arrays of shape (len(y_vals), len(x_vals))
+    '''
+    
+    grid = dict(params)
+    grid[x_name] = np.asarray(x_vals, dtype=float)[None,:]
+    grid[y_name] = np.asarray(y_vals, dtype=float)[:,None]
+    
+    apd_final, period, lyapunov, n_stim = classify_dynamics_batch_model(
+        model, grid['apd0'], [grid[name] for name in model.param_names],
+        grid['theta'], grid['ts'], **kwargs)
+    
+    # Make sure the output spans the grid even if neither axis is used
+    shape = (len(y_vals), len(x_vals))
+    period, lyapunov, n_stim = [np.broadcast_to(arr, shape) for arr in
+                                (period, lyapunov, n_stim)]
+    
+    return period, lyapunov, n_stim
+
+
 
+def make_regime_map_fig(x_name, x_vals, y_name, y_vals, period, lyapunov, n_stim,
+                        quantity='period', x_current=None, y_current=None):
+    '''
+    Make heatmap of the long-term dynamics over two parameters.
+    
+    Input:
+        period, lyapunov, n_stim: output of compute_regime_map
+        quantity: 'period', 'lyapunov' or 'ratio' (stimulus:response ratio)
+        x_current, y_current: current parameter values, marked on the map
+    '''
+    
+    if quantity == 'lyapunov':
+        z = lyapunov
+        heatmap_kwargs = dict(colorscale='RdBu_r', zmid=0,
+                              colorbar={'title':'Lyapunov exp.'})
+    elif quantity == 'ratio':
+        # Stimulus:response ratio as a number (nan if no cycle was found)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = np.where(period > 0, n_stim/period, np.nan)
+        heatmap_kwargs = dict(colorscale='Viridis',
+                              colorbar={'title':'Stim:resp'})
+    else:
+        # Period 0 means no cycle was found up to max_period
+        z = np.where(period > 0, period, np.nan)
+        heatmap_kwargs = dict(colorscale='Viridis',
+                              colorbar={'title':'Period'})
+    
     fig = go.Figure()
     fig.add_trace(
-        go.Scatter(x=x, y=y,
+        go.Heatmap(x=x_vals, y=y_vals, z=z,
+                   **heatmap_kwargs,
+                   )
+    )
+    
+    # Marker for the current parameter values
+    fig.add_trace(
+        go.Scatter(x=[x_current], y=[y_current],
                    showlegend=False,
-                   mode='markers+lines',
+                   mode='markers',
+                   marker={'color':'white', 'size':10, 'symbol':'x',
+                           'line':{'width':1, 'color':'black'}},
                    )
     )
-    fig.update_xaxes(title = r'$\text{Iteration}$',)
-    fig.update_yaxes(title = r'$\text{APD (ms)}$',range=[0,500])
+    
+    fig.update_xaxes(title = x_name)
+    fig.update_yaxes(title = y_name)
     
     fig.update_layout(
-        height=300,
+        height=400,
         margin=dict(l=50,r=10,t=30,b=10),
-        title=r'$\text{APD sequence}$',
+        title=r'$\text{Regime map}$',
         )
     
-    return fig    
-
+    return fig
 
 
 
@@ -392,4 +1933,3 @@ def make_apd_sequence(apd_traj):
 
 # fig = make_restitution_fig_sigmoid(a, b, x0)
 # fig.write_html('temp3.html')
-
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 17 Oct 2026
+
+Benchmarks for the map, trajectory, figure and callback code paths.
+
+Each benchmark is timed with timeit (several repeats of an automatically
+chosen number of loops) and the best and median time per call are saved to
+a JSON file, together with the git commit and package versions, so that
+runs on different commits can be compared.
+
+Example:
+    python benchmark.py -o bench_new.json
+    python benchmark.py -o bench_new.json --compare bench_old.json
+"""
+
+import sys
+import json
+import time
+import timeit
+import platform
+import argparse
+import itertools
+import subprocess
+
+import numpy as np
+
+import app_functions as af
+
+
+
+# Default parameters (as in app.py)
+apd0 = 150
+a = 201.3
+b = 46.6
+x0 = -13.5
+theta = 0
+ts = 300
+nmax = 40
+
+apd_traj = af.generate_cobweb_trajectory_sigmoid(nmax, apd0, a, b, x0, theta, ts)
+apd_array = np.linspace(0, 600, 100000)
+
+
+def clear_caches():
+    '''
+    Clear the memoized curve samples so figures are built from scratch
+    '''
+    af.sample_cobweb_map_model.cache_clear()
+    af._sample_restitution_curve.cache_clear()
+
+
+def make_cobweb_fig_cold():
+    clear_caches()
+    af.make_cobweb_fig_sigmoid(a, b, x0, theta, ts, apd_traj)
+
+
+def make_restitution_fig_cold():
+    clear_caches()
+    af.make_restitution_fig_sigmoid(a, b, x0)
+
+
+# Benchmarks of app_functions (name: function called with no arguments)
+benchmarks = {
+    'cobweb_map_sigmoid (scalar)':
+        lambda: af.cobweb_map_sigmoid(apd0, a, b, x0, theta, ts),
+    'cobweb_map_sigmoid (array of 1e5)':
+        lambda: af.cobweb_map_sigmoid(apd_array, a, b, x0, theta, ts),
+    'generate_cobweb_trajectory_sigmoid (nmax=40)':
+        lambda: af.generate_cobweb_trajectory_sigmoid(40, apd0, a, b, x0, theta, ts),
+    'generate_cobweb_trajectory_sigmoid (nmax=1e3)':
+        lambda: af.generate_cobweb_trajectory_sigmoid(1000, apd0, a, b, x0, theta, ts),
+    'generate_cobweb_trajectory_sigmoid (nmax=1e5)':
+        lambda: af.generate_cobweb_trajectory_sigmoid(100000, apd0, a, b, x0, theta, ts),
+    'downsample_cobweb_trajectory_model (nmax=1e7)':
+        lambda: af.downsample_cobweb_trajectory_model(
+            af.sigmoid_model, 10**7, apd0, (a, b, x0), theta, ts),
+    'compute_basins_model (1e5 initial conditions)':
+        lambda: af.compute_basins_model(
+            af.sigmoid_model, np.linspace(0, 250, 10**5), (a, b, x0), theta, ts),
+    'make_cobweb_fig_sigmoid':
+        make_cobweb_fig_cold,
+    'make_cobweb_fig_sigmoid (cached curve)':
+        lambda: af.make_cobweb_fig_sigmoid(a, b, x0, theta, ts, apd_traj),
+    'make_restitution_fig_sigmoid':
+        make_restitution_fig_cold,
+    'make_apd_sequence':
+        lambda: af.make_apd_sequence(apd_traj),
+    }
+
+
+
+class CallbackClient:
+    '''
+    Post callback requests to the app through the Flask test client, as the
+    browser does when a slider is moved
+    '''
+
+    def __init__(self):
+        import app
+        self.app = app
+        self.client = app.server.test_client()
+        self.client.get('/')
+        self.deps = self.client.get('/_dash-dependencies').get_json()
+        self.values = {
+            'apd0_slider': app.apd0, 'nmax_slider': app.nmax,
+            'model_dropdown': app.model_name,
+            'apdmax_slider': app.apdmax, 'alpha_slider': app.alpha,
+            'tau_slider': app.tau, 'a_slider': app.a, 'b_slider': app.b,
+            'x0_slider': app.x0, 'theta_slider': app.theta, 'ts_slider': app.ts,
+            'regime_x_dropdown': app.regime_x, 'regime_y_dropdown': app.regime_y,
+            'regime_quantity_dropdown': app.regime_quantity,
+            }
+        # Keys of the figures in the layout (State of the callbacks)
+        self.values.update(app.figure_keys)
+        self.bytes = {}
+
+
+    def request(self, output):
+        '''
+        Body of a request for the callback with output (a component id or
+        the output string of the callback)
+        '''
+        dep = next(d for d in self.deps if output in d['output'])
+        outputs = []
+        for out in dep['output'].strip('.').split('...'):
+            id_, prop = out.rsplit('.', 1)
+            outputs.append({'id': id_, 'property': prop})
+        return {
+            'output': dep['output'],
+            'outputs': outputs if dep['output'].startswith('..') else outputs[0],
+            'inputs': [dict(i) for i in dep['inputs']],
+            'state': [dict(s) for s in dep['state']],
+            }
+
+
+    def post(self, body, values, changed):
+        body = dict(body, changedPropIds=[c+'.value' for c in changed])
+        for item in body['inputs'] + body['state']:
+            item['value'] = values.get(item['id'])
+        r = self.client.post('/_dash-update-component', json=body)
+        if r.status_code != 200:
+            raise RuntimeError('Callback {} failed with status {}'.format(
+                body['output'], r.status_code))
+        return r
+
+
+    def benchmark(self, name, output, slider, new_values):
+        '''
+        Function that moves slider to the next of new_values and posts the
+        callback for output. Distinct values defeat the memoization of the
+        app, so this times the full computation.
+        '''
+        body = self.request(output)
+        values_iter = itertools.cycle(new_values)
+        def run():
+            values = dict(self.values, **{slider: next(values_iter)})
+            r = self.post(body, values, [slider])
+            self.bytes[name] = len(r.data)
+        return run
+
+
+def callback_benchmarks():
+    '''
+    Benchmarks of the update_figs callback (cobweb plot, APD sequence and
+    regime text) through the Flask test client against app.server
+    '''
+    client = CallbackClient()
+    b_values = b + np.arange(1, 2001)*1e-3
+    apd0_values = apd0 + np.arange(1, 2001)*1e-3
+    return client, {
+        'update_figs round-trip (b_slider)':
+            client.benchmark('update_figs round-trip (b_slider)',
+                             'fig_cobweb', 'b_slider', b_values),
+        'update_figs round-trip (apd0_slider)':
+            client.benchmark('update_figs round-trip (apd0_slider)',
+                             'fig_cobweb', 'apd0_slider', apd0_values),
+        }
+
+
+
+def time_function(func, repeat=5, min_time=0.2):
+    '''
+    Time func with timeit. Returns the best and median time per call (s)
+    and the number of calls per repeat.
+    '''
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        t = timer.timeit(number)
+        if t >= min_time or number >= 1e6:
+            break
+        number = max(number*2, int(number*min_time/max(t, 1e-9)))
+    times = [t/number] + [timer.timeit(number)/number for i in range(repeat-1)]
+    return {'best': min(times), 'median': float(np.median(times)), 'number': number}
+
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+def run_benchmarks(pattern=None, repeat=5, callbacks=True):
+    '''
+    Run the benchmarks whose name contains pattern
+    '''
+
+    import dash
+    import plotly
+    meta = {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'plotly': plotly.__version__,
+        'dash': dash.__version__,
+        }
+
+    funcs = dict(benchmarks)
+    client = None
+    if callbacks:
+        client, funcs_callback = callback_benchmarks()
+        funcs.update(funcs_callback)
+
+    results = {}
+    for name, func in funcs.items():
+        if pattern and pattern not in name:
+            continue
+        results[name] = time_function(func, repeat=repeat)
+        if client is not None and name in client.bytes:
+            results[name]['bytes'] = client.bytes[name]
+        print('{:<50} {:>12}'.format(name, format_time(results[name]['best'])), flush=True)
+
+    return {'meta': meta, 'results': results}
+
+
+
+def format_time(t):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if t >= scale:
+            return '{:.3g} {}'.format(t/scale, unit)
+    return '{:.3g} ns'.format(t/1e-9)
+
+
+
+def compare(new, old, threshold=1.1):
+    '''
+    Print the ratio of the best times of two runs. Returns the names of the
+    benchmarks that are slower than old by more than the threshold.
+    '''
+    print('\nComparison with commit {} (best time, new/old)'.format(old['meta'].get('commit')))
+    slower = []
+    for name, res in new['results'].items():
+        if name not in old['results']:
+            continue
+        t_old = old['results'][name]['best']
+        ratio = res['best']/t_old
+        flag = ''
+        if ratio > threshold:
+            flag = 'SLOWER'
+            slower.append(name)
+        elif ratio < 1/threshold:
+            flag = 'faster'
+        print('{:<50} {:>10} {:>10} {:>7.2f} {}'.format(
+            name, format_time(t_old), format_time(res['best']), ratio, flag))
+    return slower
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmarks of the cobweb app')
+    parser.add_argument('-o', '--output', default=None,
+                        help='Save the results to this JSON file')
+    parser.add_argument('--compare', default=None,
+                        help='JSON file of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=1.1,
+                        help='Ratio of times above which a benchmark counts as slower')
+    parser.add_argument('-k', '--filter', default=None,
+                        help='Only run benchmarks whose name contains this string')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of repeats of each benchmark')
+    parser.add_argument('--no-callbacks', action='store_true',
+                        help='Skip the benchmarks that go through the app')
+    args = parser.parse_args()
+
+    report = run_benchmarks(pattern=args.filter, repeat=args.repeat,
+                            callbacks=not args.no_callbacks)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+        print('Saved to {}'.format(args.output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if compare(report, old, threshold=args.threshold):
+            sys.exit(1)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 17 Oct 2026
+
+Server-side coalescing of stale callback requests.
+
+While a slider is dragged the browser can send many requests for the same
+callback, and it only displays the result of the last one. To avoid
+computing the others, the renderer hook request_hook (passed to dash.Dash as
+hooks) tags every callback request with an id for the page and a sequence
+number that increases with each request. The server keeps the latest
+sequence number seen for each page, callback and set of changed inputs,
+and callbacks decorated with coalesce_callback return no update
+(PreventUpdate) for a request when a later request of the same callback,
+triggered by the same inputs, has already arrived. Requests triggered by
+other inputs are never dropped. Callbacks that patch their figures compare
+the parameters with those of the figure shown (kept in a dcc.Store), so a
+dropped request never leaves part of a figure out of date.
+
+The sequence numbers are kept in an array of shared memory, so with
+gunicorn --preload the workers of a server see each other's requests, and
+a request is dropped whichever worker handles it. Requests are ordered by
+the sequence number from the browser, not by the order they reach the
+server. Pages are hashed into a fixed number of slots; if two pages share a
+slot, requests are computed as if there were no coalescing.
+
+Set up by environment variables
+    COBWEB_COALESCE: '0' to turn coalescing off (default on)
+    COBWEB_COALESCE_WINDOW: time in s that a request waits for a later one
+        before it is computed (default 0). A short window (e.g. 0.02)
+        drops more of the requests sent while dragging, at the cost of
+        that delay on every request.
+"""
+
+import os
+import time
+import hashlib
+import functools
+import multiprocessing
+
+from flask import request, has_request_context
+from dash.exceptions import PreventUpdate
+
+
+
+coalesce_enabled = os.environ.get('COBWEB_COALESCE', '1') != '0'
+coalesce_window = float(os.environ.get('COBWEB_COALESCE_WINDOW', 0))
+
+# Renderer hook that adds the page id and sequence number to the body of
+# every callback request
+request_hook = '''(function() {
+    var session = Math.random().toString(36).slice(2) + Date.now().toString(36);
+    var seq = 0;
+    return function(payload) {
+        seq += 1;
+        payload.coalesce = {session: session, seq: seq};
+    };
+})()'''
+
+
+
+class SequenceTable:
+    '''
+    Latest sequence number for each key, in a hash table of n_slots slots in
+    shared memory. Each slot holds a tag of the key and the sequence number.
+    '''
+
+    def __init__(self, n_slots=65536):
+        self.n_slots = n_slots
+        self.tags = multiprocessing.RawArray('q', n_slots)
+        self.seqs = multiprocessing.RawArray('q', n_slots)
+        self.lock = multiprocessing.Lock()
+
+
+    def _slot(self, key):
+        h = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(),
+                           'little', signed=True)
+        return h % self.n_slots, h
+
+
+    def update(self, key, seq):
+        '''
+        Record sequence number seq for key. Returns the latest sequence
+        number seen for key.
+        '''
+        slot, tag = self._slot(key)
+        with self.lock:
+            if self.tags[slot] != tag or self.seqs[slot] < seq:
+                self.tags[slot] = tag
+                self.seqs[slot] = seq
+            return self.seqs[slot]
+
+
+    def latest(self, key):
+        '''
+        Latest sequence number seen for key (None if the slot was taken
+        by another key)
+        '''
+        slot, tag = self._slot(key)
+        with self.lock:
+            return self.seqs[slot] if self.tags[slot] == tag else None
+
+
+sequences = SequenceTable()
+
+
+
+def request_key(name):
+    '''
+    Key (page, callback name, changed inputs) and sequence number of the
+    current callback request, or (None, None) if it has none (e.g. requests
+    that are not from the browser)
+    '''
+    if not has_request_context():
+        return None, None
+    body = request.get_json(silent=True) or {}
+    tag = body.get('coalesce')
+    if not isinstance(tag, dict):
+        return None, None
+    session, seq = tag.get('session'), tag.get('seq')
+    if not isinstance(session, str) or not isinstance(seq, int):
+        return None, None
+    changed = ','.join(sorted(map(str, body.get('changedPropIds') or [])))
+    return '{}:{}:{}'.format(session, name, changed), seq
+
+
+
+def coalesce_callback(func):
+    '''
+    Decorator that skips a call of the callback func (raising PreventUpdate)
+    if a later request of it from the same page and with the same changed
+    inputs has arrived.
+    '''
+
+    if not coalesce_enabled:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key, seq = request_key(func.__name__)
+        if key is None:
+            return func(*args, **kwargs)
+        if sequences.update(key, seq) > seq:
+            raise PreventUpdate
+        if coalesce_window > 0:
+            time.sleep(coalesce_window)
+            latest = sequences.latest(key)
+            if latest is not None and latest > seq:
+                raise PreventUpdate
+        return func(*args, **kwargs)
+
+    return wrapper
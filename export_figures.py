@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 17 Oct 2026
+
+Export the cobweb plot, restitution curve and APD sequence for each row of a
+table of parameters, without running the app.
+
+The table is a CSV file with the parameters of a restitution model in columns
+named as in the app (a, b, x0 for the sigmoid model, apdmax, alpha, tau for
+the exponential model) and optional columns
+    name (or dataset): used in the file names (default: row number)
+    model: 'sigmoid' (default) or 'exponential'
+    apd0, nmax, theta, ts: simulation parameters (default: the options below)
+so the output table of fitting.py can be used as it is.
+
+Rows are split into chunks that are rendered in parallel by a pool of
+processes. Figures are saved as standalone HTML files and/or plotly JSON
+files. The HTML files load plotly.js from a single plotly.min.js written to
+the output directory, instead of embedding a copy in every file.
+
+Example:
+    python export_figures.py params.csv -o figures --format html json --workers 8
+"""
+
+import os
+import re
+import argparse
+import multiprocessing
+
+import pandas as pd
+from plotly.offline import get_plotlyjs
+
+from app_functions import restitution_models, generate_cobweb_trajectory_model,\
+    make_cobweb_fig_model, make_restitution_fig_model, make_apd_sequence
+
+
+
+# Default simulation parameters (as in app.py)
+sim_defaults = {'apd0': 150, 'nmax': 40, 'theta': 0, 'ts': 300}
+
+plotlyjs_name = 'plotly.min.js'
+
+
+
+def row_name(row, i):
+    '''
+    Name of a row for file names, with the model if the table has a model
+    column (a fit table has a row per dataset and model)
+    '''
+    name = 'row{:05d}'.format(i)
+    for col in ('name', 'dataset'):
+        if col in row and pd.notna(row[col]) and str(row[col]).strip():
+            name = str(row[col]).strip()
+            break
+    if 'model' in row:
+        name = '{}_{}'.format(name, row['model'])
+    return re.sub(r'[^\w.-]+', '_', name)
+
+
+
+def row_figures(row, sim):
+    '''
+    Cobweb, restitution and APD sequence figures for one row of the table
+    '''
+    model_name = row.get('model', 'sigmoid')
+    if not isinstance(model_name, str) or model_name not in restitution_models:
+        raise ValueError('Unknown model {}'.format(model_name))
+    model = restitution_models[model_name]
+    params = tuple(float(row[name]) for name in model.param_names)
+    apd0, theta, ts = (float(sim[k]) for k in ('apd0', 'theta', 'ts'))
+    nmax = int(sim['nmax'])
+
+    apd_traj = generate_cobweb_trajectory_model(model, nmax, apd0, params, theta, ts)
+    return {
+        'cobweb': make_cobweb_fig_model(model, params, theta, ts, apd_traj),
+        'restitution': make_restitution_fig_model(model, params),
+        'apd_sequence': make_apd_sequence(apd_traj),
+        }
+
+
+
+def _export_rows(args):
+    '''
+    Render and save the figures of one chunk of rows. Runs in a worker process.
+    Returns the paths written.
+    '''
+    rows, out_dir, formats, defaults = args
+    paths = []
+    for i, row in rows:
+        sim = {k: row[k] if k in row and pd.notna(row[k]) else v
+               for k, v in defaults.items()}
+        name = row_name(row, i)
+        for fig_name, fig in row_figures(row, sim).items():
+            base = os.path.join(out_dir, '{}_{}'.format(name, fig_name))
+            if 'html' in formats:
+                fig.write_html(base + '.html', include_plotlyjs=plotlyjs_name,
+                               include_mathjax='cdn', full_html=True)
+                paths.append(base + '.html')
+            if 'json' in formats:
+                fig.write_json(base + '.json')
+                paths.append(base + '.json')
+    return paths
+
+
+
+def export_table(table, out_dir, formats=('html',), workers=None, chunk_size=20,
+                 defaults=sim_defaults):
+    '''
+    Export the figures of each row of a DataFrame of parameters to out_dir.
+    Returns the paths of the files written.
+    '''
+
+    os.makedirs(out_dir, exist_ok=True)
+    if 'html' in formats:
+        with open(os.path.join(out_dir, plotlyjs_name), 'w', encoding='utf-8') as f:
+            f.write(get_plotlyjs())
+
+    rows = [(i, row.to_dict()) for i, row in table.iterrows()]
+    chunks = [(rows[i:i+chunk_size], out_dir, tuple(formats), dict(defaults))
+              for i in range(0, len(rows), chunk_size)]
+    if workers == 1 or len(chunks) <= 1:
+        results = [_export_rows(chunk) for chunk in chunks]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.map(_export_rows, chunks)
+
+    return [path for paths in results for path in paths]
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Export cobweb, restitution and APD sequence figures for a table of parameters')
+    parser.add_argument('table', help='CSV file with a row of parameters per figure set')
+    parser.add_argument('-o', '--output', default='figures',
+                        help='Output directory (default figures)')
+    parser.add_argument('--format', nargs='+', choices=['html', 'json'], default=['html'],
+                        help='Output formats (default html)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of processes (default: number of cores)')
+    parser.add_argument('--chunk-size', type=int, default=20,
+                        help='Number of rows per chunk')
+    for name, value in sim_defaults.items():
+        parser.add_argument('--' + name, type=int if name == 'nmax' else float, default=value,
+                            help='{} for rows without a {} column (default {})'.format(
+                                name, name, value))
+    args = parser.parse_args()
+
+    table = pd.read_csv(args.table)
+    defaults = {name: getattr(args, name) for name in sim_defaults}
+    paths = export_table(table, args.output, args.format, workers=args.workers,
+                         chunk_size=args.chunk_size, defaults=defaults)
+    print('Exported {} files for {} rows to {}'.format(len(paths), len(table), args.output))
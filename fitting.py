@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 17 Oct 2026
+
+Fit restitution models to S1-S2 restitution datasets.
+
+Each dataset is a CSV file with columns DI and APD (in ms). Datasets are
+padded to a common length and fitted together by Levenberg-Marquardt least
+squares, vectorized across datasets, using the analytic Jacobian of each
+model (RestitutionModel.param_jacobian). Files are split into chunks that
+are loaded and fitted in parallel by a pool of processes.
+
+The result is a table with one row per dataset and model, with the fitted
+parameters, the RMSE and whether the fit converged. It can be loaded into
+the app to set the sliders.
+
+Example:
+    python fitting.py recordings/ -o fits.csv --workers 8
+"""
+
+import os
+import glob
+import argparse
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from app_functions import restitution_models
+
+
+
+def read_dataset(file):
+    '''
+    Read the (DI, APD) points of one dataset from a CSV file (path or
+    file-like object). Column names are matched case-insensitively, and the
+    first two columns are used if there are no DI and APD columns.
+    '''
+    df = pd.read_csv(file)
+    cols = {str(col).strip().lower(): col for col in df.columns}
+    if 'di' in cols and 'apd' in cols:
+        df = df[[cols['di'], cols['apd']]]
+    else:
+        df = df.iloc[:,:2]
+    values = df.apply(pd.to_numeric, errors='coerce').dropna().to_numpy(dtype=float)
+    if values.shape[1] < 2 or len(values) == 0:
+        raise ValueError('Expected numeric DI and APD columns')
+    return values[:,0], values[:,1]
+
+
+
+def pad_datasets(datasets):
+    '''
+    Stack datasets of different lengths into 2D arrays padded with zeros.
+
+    Input:
+        datasets: list of (di, apd) arrays
+
+    Output:
+        di, apd: arrays of shape (n_sets, n_max)
+        mask: boolean array, True for the entries that are data
+    '''
+    n_max = max([len(di) for di, apd in datasets] + [1])
+    di = np.zeros((len(datasets), n_max))
+    apd = np.zeros((len(datasets), n_max))
+    mask = np.zeros((len(datasets), n_max), dtype=bool)
+    for i, (x, y) in enumerate(datasets):
+        di[i,:len(x)] = x
+        apd[i,:len(y)] = y
+        mask[i,:len(x)] = True
+    return di, apd, mask
+
+
+
+def fit_model_batch(model, di, apd, mask, params0=None, n_iter=200, tol=1e-10):
+    '''
+    Least squares fit of a restitution model to many datasets at once by the
+    Levenberg-Marquardt method. Datasets that have converged are dropped from
+    the iteration.
+
+    Input:
+        model: RestitutionModel with param_jacobian and initial_guess
+        di, apd, mask: arrays of shape (n_sets, n_max) as from pad_datasets
+        params0: starting parameters of shape (n_sets, n_params). Default
+            is model.initial_guess.
+        n_iter: maximum number of iterations
+        tol: relative decrease in the sum of squares (or step size) below
+            which a fit has converged
+
+    Output:
+        params: fitted parameters, shape (n_sets, n_params)
+        rmse: root mean square error of each fit (ms)
+        converged: boolean array
+    '''
+
+    n_sets = di.shape[0]
+    w = mask.astype(float)
+    if params0 is None:
+        params0 = model.initial_guess(di, apd, mask)
+    params = np.array(params0, dtype=float)
+
+    def residuals(idx, p):
+        with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+            r = (model.evaluate(di[idx], *p.T[...,None]) - apd[idx])*w[idx]
+        return np.where(np.isfinite(r), r, np.inf)
+
+    def sum_squares(r):
+        with np.errstate(over='ignore'):
+            return (r*r).sum(axis=1)
+
+    idx = np.arange(n_sets)
+    r = residuals(idx, params)
+    cost = sum_squares(r)
+    lam = np.full(n_sets, 1e-3)
+    active = np.isfinite(cost) & (mask.sum(axis=1) >= params.shape[1])
+    converged = np.zeros(n_sets, dtype=bool)
+
+    for it in range(n_iter):
+        idx = np.flatnonzero(active)
+        if idx.size == 0:
+            break
+        p = params[idx]
+
+        # Jacobian of the residuals, shape (n, n_max, n_params)
+        with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+            J = np.stack(model.param_jacobian(di[idx], *p.T[...,None]), axis=-1)
+        J = np.nan_to_num(J*w[idx,:,None], posinf=0, neginf=0)
+
+        # Damped normal equations (J^T J + lam diag(J^T J)) delta = -J^T r
+        JTJ = np.einsum('nki,nkj->nij', J, J)
+        g = np.einsum('nki,nk->ni', J, r[idx])
+        d = np.einsum('nii->ni', JTJ)
+        A = JTJ + (lam[idx,None]*d + 1e-12)[...,None]*np.eye(p.shape[1])
+        delta = -np.linalg.solve(A, g[...,None])[...,0]
+
+        p_new = p + delta
+        r_new = residuals(idx, p_new)
+        cost_new = sum_squares(r_new)
+        better = cost_new < cost[idx]
+
+        # Accept steps that reduce the sum of squares and shrink the damping
+        i_better = idx[better]
+        small = (cost[i_better] - cost_new[better] <= tol*cost[i_better]) | \
+            np.all(np.abs(delta[better]) <= tol*(np.abs(p_new[better]) + tol), axis=1)
+        params[i_better] = p_new[better]
+        r[i_better] = r_new[better]
+        cost[i_better] = cost_new[better]
+        lam[idx] = np.where(better, lam[idx]/3, lam[idx]*3)
+
+        # Stop at a minimum (small step, or no step reduces the cost)
+        done = i_better[small]
+        stuck = idx[~better & (lam[idx] > 1e10)]
+        converged[done] = True
+        converged[stuck] = True
+        active[done] = False
+        active[stuck] = False
+
+    n = np.maximum(mask.sum(axis=1), 1)
+    rmse = np.sqrt(cost/n)
+
+    return params, rmse, converged
+
+
+
+def fit_table(names, datasets, models=None):
+    '''
+    Fit each model to each dataset.
+
+    Input:
+        names: list of dataset names
+        datasets: list of (di, apd) arrays
+        models: list of model names (default: all registered models)
+
+    Output:
+        DataFrame with columns dataset, model, n_points, rmse, converged
+        and the parameters of all models (nan for parameters of other models)
+    '''
+
+    if models is None:
+        models = list(restitution_models)
+    param_cols = []
+    for name in models:
+        param_cols += [p for p in restitution_models[name].param_names if p not in param_cols]
+
+    di, apd, mask = pad_datasets(datasets)
+
+    tables = []
+    for name in models:
+        model = restitution_models[name]
+        params, rmse, converged = fit_model_batch(model, di, apd, mask)
+        table = pd.DataFrame({
+            'dataset': names,
+            'model': name,
+            'n_points': mask.sum(axis=1),
+            'rmse': rmse,
+            'converged': converged,
+            })
+        for col in param_cols:
+            table[col] = params[:,model.param_names.index(col)] \
+                if col in model.param_names else np.nan
+        tables.append(table)
+
+    return pd.concat(tables, ignore_index=True)
+
+
+
+def find_datasets(paths):
+    '''
+    CSV files in paths (files, or directories that are searched recursively)
+    '''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, '**', '*.csv'), recursive=True))
+        else:
+            files.append(path)
+    return files
+
+
+
+def _fit_files(args):
+    '''
+    Load and fit one chunk of files. Runs in a worker process.
+    '''
+    files, models = args
+    datasets = [read_dataset(file) for file in files]
+    names = [os.path.splitext(os.path.basename(file))[0] for file in files]
+    return fit_table(names, datasets, models)
+
+
+
+def fit_files(files, models=None, workers=None, chunk_size=500):
+    '''
+    Fit models to the datasets in a list of CSV files, in chunks of
+    chunk_size files that are run in parallel. Returns the table of fit_table
+    with the rows of each model in the order of the files.
+    '''
+
+    chunks = [(files[i:i+chunk_size], models) for i in range(0, len(files), chunk_size)]
+    if workers == 1 or len(chunks) <= 1:
+        tables = [_fit_files(chunk) for chunk in chunks]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            tables = pool.map(_fit_files, chunks)
+
+    table = pd.concat(tables, ignore_index=True)
+    return table.sort_values('model', kind='stable', ignore_index=True)
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Fit restitution models to S1-S2 datasets (CSV files with DI and APD columns)')
+    parser.add_argument('paths', nargs='+', help='CSV files or directories of CSV files')
+    parser.add_argument('-o', '--output', default='fits.csv',
+                        help='Output table (default fits.csv)')
+    parser.add_argument('--models', nargs='+', choices=list(restitution_models),
+                        default=None, help='Models to fit (default: all)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of processes (default: number of cores)')
+    parser.add_argument('--chunk-size', type=int, default=500,
+                        help='Number of datasets per chunk')
+    args = parser.parse_args()
+
+    files = find_datasets(args.paths)
+    print('Fitting {} datasets'.format(len(files)))
+    table = fit_files(files, models=args.models, workers=args.workers,
+                      chunk_size=args.chunk_size)
+    table.to_csv(args.output, index=False)
+    print('{} of {} fits converged. Saved to {}'.format(
+        int(table['converged'].sum()), len(table), args.output))
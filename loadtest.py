@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 17 Oct 2026
+
+Load test of the app with simulated users dragging the sliders.
+
+A gunicorn server is started for each worker class (or a running server is
+used with --url). The sliders and their ranges are read from /_dash-layout
+and the callbacks from /_dash-dependencies. Each user then repeatedly drags
+a slider from its current value to a random target in a number of steps, and
+at each step posts the callbacks that the slider triggers to
+/_dash-update-component, in parallel as the browser does. The requests are
+tagged with a page id and sequence number like those of the browser (see
+coalesce.py).
+
+With --interval 0 (default) each user waits for the responses of a step
+before the next one. With --interval dt, steps are sent every dt s whatever
+the responses, as when a slider is dragged with COBWEB_SLIDER_UPDATEMODE=drag.
+
+Instead of synthetic drags, sessions can be replayed from a JSON file with a
+list of sessions, each a list of steps {"id": slider id, "value": value}.
+The synthetic sessions of a run can be saved in that format with
+--save-sessions.
+
+For each setting the throughput, the 50th, 95th and 99th percentile of the
+latency, and the rate of errors (failed requests or HTTP status >= 400) and
+of responses with no update (status 204) are printed, and saved with -o.
+
+Example:
+    python loadtest.py --worker-class sync gthread --workers 2 --concurrency 1 8 32
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import uuid
+import random
+import argparse
+import threading
+import subprocess
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+
+
+app_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Packages needed by the gunicorn worker classes that are not built in
+worker_class_packages = {'gevent': 'gevent', 'eventlet': 'eventlet'}
+
+# Number of requests the browser sends at once to one host
+browser_connections = 6
+
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+
+def start_server(worker_class='sync', workers=2, threads=1, port=None, timeout=120):
+    '''
+    Start gunicorn with the app on a local port and wait until it serves
+    the page. Returns the process and the URL.
+    '''
+
+    package = worker_class_packages.get(worker_class)
+    if package and importlib.util.find_spec(package) is None:
+        raise RuntimeError('Worker class {} needs the package {}'.format(worker_class, package))
+
+    port = port or free_port()
+    url = 'http://127.0.0.1:{}'.format(port)
+    cmd = [sys.executable, '-m', 'gunicorn', 'app:server', '--preload',
+           '--bind', '127.0.0.1:{}'.format(port), '--workers', str(workers),
+           '--worker-class', worker_class, '--threads', str(threads),
+           '--timeout', '300', '--log-level', 'warning']
+    proc = subprocess.Popen(cmd, cwd=app_dir)
+
+    start = time.time()
+    while time.time() - start < timeout:
+        if proc.poll() is not None:
+            raise RuntimeError('gunicorn exited with code {}'.format(proc.returncode))
+        try:
+            if requests.get(url + '/', timeout=5).status_code == 200:
+                return proc, url
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.5)
+    stop_server(proc)
+    raise RuntimeError('gunicorn did not start within {} s'.format(timeout))
+
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+
+def layout_components(node):
+    '''
+    All components of a layout (as from /_dash-layout) that have an id
+    '''
+    if isinstance(node, list):
+        for child in node:
+            yield from layout_components(child)
+    elif isinstance(node, dict) and 'props' in node:
+        if 'id' in node['props']:
+            yield node
+        yield from layout_components(node['props'].get('children'))
+
+
+
+class AppSpec:
+    '''
+    Sliders, initial values and callbacks of the app served at url
+    '''
+
+    def __init__(self, url):
+        layout = requests.get(url + '/_dash-layout').json()
+        self.deps = requests.get(url + '/_dash-dependencies').json()
+
+        # Initial value of each (id, property) and range of each slider
+        self.values = {}
+        self.sliders = {}
+        for comp in layout_components(layout):
+            props = comp['props']
+            for prop, value in props.items():
+                self.values[(props['id'], prop)] = value
+            if comp['type'] == 'Slider':
+                self.sliders[props['id']] = (props['min'], props['max'], props.get('step', 1))
+
+
+    def triggered(self, slider):
+        '''
+        Callbacks with the value of slider as an input
+        '''
+        return [dep for dep in self.deps
+                if any(i['id'] == slider and i['property'] == 'value' for i in dep['inputs'])]
+
+
+    def body(self, dep, values, changed):
+        '''
+        Body of the request for the callback dep with the given values
+        '''
+        outputs = []
+        for out in dep['output'].strip('.').split('...'):
+            id_, prop = out.rsplit('.', 1)
+            outputs.append({'id': id_, 'property': prop})
+        return {
+            'output': dep['output'],
+            'outputs': outputs if dep['output'].startswith('..') else outputs[0],
+            'inputs': [dict(i, value=values.get((i['id'], i['property']))) for i in dep['inputs']],
+            'state': [dict(s, value=values.get((s['id'], s['property']))) for s in dep['state']],
+            'changedPropIds': ['{}.value'.format(changed)],
+            }
+
+
+
+def callback_label(dep):
+    '''
+    Short name of a callback: its first output
+    '''
+    return dep['output'].strip('.').split('...')[0]
+
+
+
+def synthetic_sessions(spec, n_sessions, drag_steps=20, sliders=None, seed=0):
+    '''
+    Random slider drags. Each session is one drag of a random slider from
+    its initial value to a random value in drag_steps steps.
+    '''
+    rng = random.Random(seed)
+    sliders = sliders or list(spec.sliders)
+    sessions = []
+    for i in range(n_sessions):
+        slider = rng.choice(sliders)
+        vmin, vmax, step = spec.sliders[slider]
+        start = spec.values[(slider, 'value')]
+        target = rng.uniform(vmin, vmax)
+        steps = []
+        for value in np.linspace(start, target, drag_steps + 1)[1:]:
+            value = float(np.clip(round(value/step)*step, vmin, vmax))
+            if value == int(value) and isinstance(step, int):
+                value = int(value)
+            steps.append({'id': slider, 'value': value})
+        sessions.append(steps)
+    return sessions
+
+
+
+class User(threading.Thread):
+    '''
+    Simulated user that plays sessions until the deadline
+    '''
+
+    def __init__(self, index, spec, url, sessions, records, deadline, interval=0):
+        super().__init__(daemon=True)
+        self.index = index
+        self.spec = spec
+        self.url = url
+        self.sessions = sessions
+        self.records = records
+        self.deadline = deadline
+        self.interval = interval
+        self.page = 'loadtest-{}'.format(uuid.uuid4().hex)
+        self.seq = 0
+        self.http = requests.Session()
+        self.http.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=browser_connections))
+
+
+    def post(self, name, body):
+        start = time.perf_counter()
+        try:
+            r = self.http.post(self.url + '/_dash-update-component', json=body, timeout=300)
+            status, size = r.status_code, len(r.content)
+        except requests.RequestException:
+            status, size = 0, 0
+        self.records.append((start, time.perf_counter() - start, name, status, size))
+
+
+    def run(self):
+        i = self.index
+        with ThreadPoolExecutor(browser_connections) as pool:
+            while time.perf_counter() < self.deadline:
+                values = dict(self.spec.values)
+                for step in self.sessions[i % len(self.sessions)]:
+                    if time.perf_counter() >= self.deadline:
+                        break
+                    t_step = time.perf_counter()
+                    values[(step['id'], 'value')] = step['value']
+                    futures = []
+                    for dep in self.spec.triggered(step['id']):
+                        self.seq += 1
+                        body = self.spec.body(dep, values, step['id'])
+                        body['coalesce'] = {'session': self.page, 'seq': self.seq}
+                        futures.append(pool.submit(self.post, callback_label(dep), body))
+                    if self.interval > 0:
+                        time.sleep(max(0, t_step + self.interval - time.perf_counter()))
+                    else:
+                        for future in futures:
+                            future.result()
+                i += 1
+
+
+
+def summarize(records):
+    '''
+    Throughput, latency percentiles and error rates of a list of records
+    (start, latency, callback, status, bytes)
+    '''
+    if not records:
+        return {'requests': 0}
+    start = np.array([r[0] for r in records])
+    latency = np.array([r[1] for r in records])
+    status = np.array([r[3] for r in records])
+    elapsed = max((start + latency).max() - start.min(), 1e-9)
+    p50, p95, p99 = np.percentile(latency, [50, 95, 99])
+    return {
+        'requests': len(records),
+        'throughput': len(records)/elapsed,
+        'p50': p50, 'p95': p95, 'p99': p99,
+        'mean': latency.mean(),
+        'error_rate': float(np.mean((status == 0) | (status >= 400))),
+        'no_update_rate': float(np.mean(status == 204)),
+        'bytes': float(np.mean([r[4] for r in records])),
+        }
+
+
+
+def run_load(url, spec, sessions, concurrency, duration, warmup=0, interval=0):
+    '''
+    Run concurrency users for warmup + duration s. Requests started during
+    the warmup are left out of the results.
+    '''
+    records = []
+    t0 = time.perf_counter()
+    users = [User(i, spec, url, sessions, records, t0 + warmup + duration, interval)
+             for i in range(concurrency)]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    records = [r for r in records if r[0] >= t0 + warmup]
+
+    by_callback = {}
+    for r in records:
+        by_callback.setdefault(r[2], []).append(r)
+    return {
+        'total': summarize(records),
+        'callbacks': {name: summarize(recs) for name, recs in sorted(by_callback.items())},
+        }
+
+
+
+def format_row(config, stats):
+    if not stats['requests']:
+        return '{:<28} no requests'.format(config)
+    return '{:<28} {:>7} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>7.2%} {:>7.2%}'.format(
+        config, stats['requests'], stats['throughput'], stats['p50']*1000,
+        stats['p95']*1000, stats['p99']*1000, stats['error_rate'], stats['no_update_rate'])
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Load test of the cobweb app with simulated slider drags')
+    parser.add_argument('--url', default=None,
+                        help='Test a running server instead of starting gunicorn')
+    parser.add_argument('--worker-class', nargs='+', default=['sync'],
+                        help='gunicorn worker classes to test (e.g. sync gthread gevent)')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Number of gunicorn workers')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='Threads per worker (for gthread)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[4],
+                        help='Numbers of simultaneous users to test')
+    parser.add_argument('--duration', type=float, default=20,
+                        help='Duration of each test in s')
+    parser.add_argument('--warmup', type=float, default=2,
+                        help='Time in s at the start of each test that is not measured')
+    parser.add_argument('--interval', type=float, default=0,
+                        help='Time between the steps of a drag in s (0: wait for the responses)')
+    parser.add_argument('--sessions', default=None,
+                        help='JSON file of sessions to replay')
+    parser.add_argument('--save-sessions', default=None,
+                        help='Save the synthetic sessions to this JSON file')
+    parser.add_argument('--n-sessions', type=int, default=100,
+                        help='Number of synthetic sessions')
+    parser.add_argument('--drag-steps', type=int, default=20,
+                        help='Number of steps of a synthetic drag')
+    parser.add_argument('--sliders', nargs='+', default=None,
+                        help='Sliders to drag (default: all)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default=None,
+                        help='Save the results to this JSON file')
+    args = parser.parse_args()
+
+    settings = [(None, None)] if args.url else [(wc, args.workers) for wc in args.worker_class]
+
+    print('{:<28} {:>7} {:>8} {:>8} {:>8} {:>8} {:>7} {:>7}'.format(
+        'setting', 'reqs', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors', '204'))
+    results = []
+    for worker_class, workers in settings:
+        proc = None
+        url = args.url
+        if url is None:
+            threads = args.threads if worker_class == 'gthread' else 1
+            proc, url = start_server(worker_class, workers, threads)
+        try:
+            spec = AppSpec(url)
+            if args.sessions:
+                with open(args.sessions) as f:
+                    sessions = json.load(f)
+            else:
+                sessions = synthetic_sessions(spec, args.n_sessions, args.drag_steps,
+                                              args.sliders, args.seed)
+                if args.save_sessions:
+                    with open(args.save_sessions, 'w') as f:
+                        json.dump(sessions, f)
+            for concurrency in args.concurrency:
+                stats = run_load(url, spec, sessions, concurrency, args.duration,
+                                 args.warmup, args.interval)
+                config = 'users={}'.format(concurrency)
+                if worker_class:
+                    config = '{} w={} {}'.format(worker_class, workers, config)
+                print(format_row(config, stats['total']), flush=True)
+                results.append({'worker_class': worker_class, 'workers': workers,
+                                'concurrency': concurrency, 'interval': args.interval,
+                                **stats})
+        finally:
+            if proc is not None:
+                stop_server(proc)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+        print('Saved to {}'.format(args.output))
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 17 Oct 2026
+
+Latency and payload metrics for the callbacks of a Dash app.
+
+instrument_app(app) adds hooks to the Flask server of the app that time every
+callback request (/_dash-update-component) and record, per callback,
+    - a histogram of the latency (s)
+    - a histogram of the response size (bytes)
+    - the number of requests by HTTP status
+Callbacks are named after their Python function (from app.callback_map).
+The metrics are served in the Prometheus text format on /metrics, and each
+callback response gets a Server-Timing header with its latency, which shows
+up in the network panel of the browser.
+
+Metrics are kept in memory by each process, so with several gunicorn
+workers each scrape of /metrics sees one worker.
+"""
+
+import time
+import threading
+from bisect import bisect_left
+
+from flask import Response, g, request
+
+
+
+# Upper bounds of the histogram buckets
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+bytes_buckets = (100, 1000, 10000, 30000, 100000, 300000, 1000000, 3000000, 10000000)
+
+
+
+class Histogram:
+    '''
+    Counts of observations in buckets with the given upper bounds, as in
+    a Prometheus histogram
+    '''
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0]*(len(self.buckets)+1)
+        self.sum = 0
+        self.count = 0
+
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+    def lines(self, name, labels):
+        '''
+        Lines of the histogram in the Prometheus text format
+        '''
+        out = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            out.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, cumulative))
+        out.append('{}_sum{{{}}} {}'.format(name, labels, self.sum))
+        out.append('{}_count{{{}}} {}'.format(name, labels, self.count))
+        return out
+
+
+
+class CallbackMetrics:
+    '''
+    Latency and response size histograms and request counts per callback
+    '''
+
+    def __init__(self):
+        self.latency = {}
+        self.size = {}
+        self.requests = {}
+        self.lock = threading.Lock()
+
+
+    def observe(self, callback, status, latency, size):
+        with self.lock:
+            if callback not in self.latency:
+                self.latency[callback] = Histogram(latency_buckets)
+                self.size[callback] = Histogram(bytes_buckets)
+            self.latency[callback].observe(latency)
+            self.size[callback].observe(size)
+            key = (callback, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+
+    def render(self):
+        '''
+        All metrics in the Prometheus text format
+        '''
+        with self.lock:
+            out = [
+                '# HELP dash_callback_duration_seconds Time to handle a callback request',
+                '# TYPE dash_callback_duration_seconds histogram',
+                ]
+            for callback, hist in sorted(self.latency.items()):
+                out += hist.lines('dash_callback_duration_seconds',
+                                  'callback="{}"'.format(callback))
+            out += [
+                '# HELP dash_callback_response_bytes Size of the callback response',
+                '# TYPE dash_callback_response_bytes histogram',
+                ]
+            for callback, hist in sorted(self.size.items()):
+                out += hist.lines('dash_callback_response_bytes',
+                                  'callback="{}"'.format(callback))
+            out += [
+                '# HELP dash_callback_requests_total Number of callback requests',
+                '# TYPE dash_callback_requests_total counter',
+                ]
+            for (callback, status), count in sorted(self.requests.items()):
+                out.append('dash_callback_requests_total{{callback="{}",status="{}"}} {}'.format(
+                    callback, status, count))
+        return '\n'.join(out) + '\n'
+
+
+
+def callback_name(app, output):
+    '''
+    Name of the function of the callback with the given output string
+    '''
+    entry = app.callback_map.get(output)
+    if entry is None:
+        return 'unknown'
+    func = entry.get('callback')
+    return getattr(func, '__name__', 'unknown')
+
+
+
+def instrument_app(app, path='/metrics'):
+    '''
+    Record metrics for the callbacks of a Dash app and serve them on path.
+    Returns the CallbackMetrics object.
+    '''
+
+    server = app.server
+    metrics = CallbackMetrics()
+
+    def is_callback():
+        return request.path.endswith('/_dash-update-component')
+
+    @server.before_request
+    def start_timer():
+        if is_callback():
+            g.callback_start = time.perf_counter()
+
+    @server.after_request
+    def record_metrics(response):
+        start = g.pop('callback_start', None)
+        if start is None:
+            return response
+        latency = time.perf_counter() - start
+        body = request.get_json(silent=True) or {}
+        name = callback_name(app, body.get('output'))
+        size = response.calculate_content_length()
+        if size is None:
+            size = len(response.get_data())
+        metrics.observe(name, response.status_code, latency, size)
+        response.headers.add('Server-Timing', 'callback;desc="{}";dur={:.2f}'.format(
+            name, latency*1000))
+        return response
+
+    @server.route(path)
+    def serve_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    return metrics
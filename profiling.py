@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 17 Oct 2026
+
+On-demand profiling of Dash callbacks, set up by environment variables
+    COBWEB_PROFILE: comma separated names of the callbacks to profile
+        (e.g. update_figs), or 'all'. Profiling is off if unset.
+    COBWEB_PROFILE_DIR: directory for the profiles (default 'profiles')
+    COBWEB_PROFILE_MODE: 'cprofile' (default) for a deterministic profile
+        saved as a .prof file (open with pstats or snakeviz), or 'sampling'
+        for stacks sampled from the running thread, saved in the collapsed
+        format of flamegraph.pl and speedscope (.folded)
+    COBWEB_PROFILE_INTERVAL: sampling interval in s (default 0.001)
+    COBWEB_PROFILE_TRIGGER: 'always' (default) to profile every call, or
+        'query' to profile only requests from a page opened with ?profile=1
+One file is written per profiled request.
+
+Callbacks are decorated with profile_callback, which returns the callback
+unchanged unless it is selected, so there is no overhead when profiling
+is off.
+"""
+
+import os
+import sys
+import time
+import cProfile
+import threading
+import functools
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+
+
+
+profile_names = {name.strip() for name in
+                 os.environ.get('COBWEB_PROFILE', '').split(',') if name.strip()}
+profile_dir = os.environ.get('COBWEB_PROFILE_DIR', 'profiles')
+profile_mode = os.environ.get('COBWEB_PROFILE_MODE', 'cprofile')
+profile_interval = float(os.environ.get('COBWEB_PROFILE_INTERVAL', 0.001))
+profile_trigger = os.environ.get('COBWEB_PROFILE_TRIGGER', 'always')
+
+
+
+class SamplingProfiler:
+    '''
+    Sample the call stack of the current thread from a background thread,
+    and count the stacks in collapsed format ('outer;...;inner count')
+    '''
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+
+
+    def _sample(self, thread_id):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{} ({}:{})'.format(
+                    code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._sample,
+                                        args=(threading.get_ident(),), daemon=True)
+        self._thread.start()
+        return self
+
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+
+def profile_requested():
+    '''
+    Whether the current request should be profiled. With the query trigger
+    this checks the page URL (the Referer of the callback request) for
+    profile=1.
+    '''
+    if profile_trigger != 'query':
+        return True
+    from flask import request, has_request_context
+    if not has_request_context():
+        return False
+    query = parse_qs(urlparse(request.referrer or '').query)
+    return query.get('profile', ['0'])[0] not in ('0', '')
+
+
+
+def profile_path(name, ext):
+    os.makedirs(profile_dir, exist_ok=True)
+    return os.path.join(profile_dir, '{}-{}-{}.{}'.format(
+        name, time.strftime('%Y%m%d-%H%M%S'), time.perf_counter_ns(), ext))
+
+
+
+def profile_callback(func):
+    '''
+    Decorator that profiles calls of func if it is selected by COBWEB_PROFILE.
+    Otherwise func is returned as it is.
+    '''
+
+    if func.__name__ not in profile_names and 'all' not in profile_names:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not profile_requested():
+            return func(*args, **kwargs)
+
+        if profile_mode == 'sampling':
+            profiler = SamplingProfiler(profile_interval)
+            with profiler:
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    profiler.dump(profile_path(func.__name__, 'folded'))
+
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func, *args, **kwargs)
+        finally:
+            profiler.dump_stats(profile_path(func.__name__, 'prof'))
+
+    return wrapper
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 17 Oct 2026
+
+Cache of computed results shared by the gunicorn workers of a server.
+
+Results are stored in a SQLite database (in WAL mode, so workers read it
+concurrently) under keys made of a namespace and the parameters, with float
+parameters rounded to a number of decimals so that values that differ only
+by floating point noise share an entry. The total size of the entries is
+bounded: when it is exceeded the least recently used entries are deleted.
+Keys include a version string (in the app, a hash of the code), so results
+of another version of the code are never returned.
+
+Two kinds of results are cached in the app:
+    - return values of functions decorated with memoize (trajectories and
+      map curve samples), pickled
+    - serialized responses of callbacks (cache_responses), keyed on the
+      callback, its input and state values and the inputs that changed. A
+      hit is returned before Dash runs the callback, so it skips both the
+      computation and the serialization.
+
+The cache is off unless the environment variable COBWEB_CACHE is set to
+the path of the database. Other settings
+    COBWEB_CACHE_SIZE: maximum total size of the entries in MB (default 256)
+    COBWEB_CACHE_DECIMALS: decimals of float parameters in keys (default 6)
+"""
+
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+import functools
+
+import numpy as np
+from flask import Response, g, request
+
+from metrics import callback_name
+
+
+
+class ResultCache:
+    '''
+    Size-bounded LRU cache of bytes in a SQLite database. Connections are
+    opened per process and thread, so the cache can be created before
+    gunicorn forks its workers.
+    '''
+
+    def __init__(self, path, max_bytes=256*2**20, decimals=6, version=''):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.decimals = decimals
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._connect()
+
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY, value BLOB, size INTEGER, atime REAL)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS cache_atime ON cache (atime, size)')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+
+    def key(self, namespace, *args):
+        '''
+        Key of a result from its namespace and parameters
+        '''
+        text = json.dumps([self.version, namespace, quantize(args, self.decimals)])
+        return hashlib.sha1(text.encode()).hexdigest()
+
+
+    def get(self, key):
+        '''
+        Value stored under key (bytes), or None
+        '''
+        conn = self._connect()
+        row = conn.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        conn.execute('UPDATE cache SET atime = ? WHERE key = ?', (time.time(), key))
+        return row[0]
+
+
+    def set(self, key, value):
+        '''
+        Store value (bytes) under key, then delete the least recently used
+        entries if the cache is too large
+        '''
+        if len(value) > self.max_bytes:
+            return
+        conn = self._connect()
+        conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                     (key, sqlite3.Binary(value), len(value), time.time()))
+        total = conn.execute('SELECT total(size) FROM cache').fetchone()[0]
+        if total > self.max_bytes:
+            self.evict(total - 0.9*self.max_bytes)
+
+
+    def evict(self, n_bytes):
+        '''
+        Delete the least recently used entries with a total size of at
+        least n_bytes
+        '''
+        conn = self._connect()
+        keys = []
+        freed = 0
+        for key, size in conn.execute('SELECT key, size FROM cache ORDER BY atime'):
+            keys.append((key,))
+            freed += size
+            if freed >= n_bytes:
+                break
+        conn.executemany('DELETE FROM cache WHERE key = ?', keys)
+
+
+    def stats(self):
+        conn = self._connect()
+        n, size = conn.execute('SELECT count(*), total(size) FROM cache').fetchone()
+        return {'entries': n, 'bytes': int(size), 'hits': self.hits, 'misses': self.misses}
+
+
+    def clear(self):
+        self._connect().execute('DELETE FROM cache')
+
+
+
+def quantize(value, decimals):
+    '''
+    Value with floats (also inside tuples, lists and dicts) rounded to
+    decimals, for use in a key
+    '''
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        value = round(float(value), decimals)
+        return value if np.isfinite(value) else str(value)
+    if isinstance(value, (tuple, list)):
+        return [quantize(v, decimals) for v in value]
+    if isinstance(value, dict):
+        return {str(k): quantize(v, decimals) for k, v in sorted(value.items())}
+    return value
+
+
+
+def open_result_cache(version=''):
+    '''
+    Cache at the path in COBWEB_CACHE, or None if it is not set
+    '''
+    path = os.environ.get('COBWEB_CACHE')
+    if not path:
+        return None
+    return ResultCache(path,
+                       max_bytes=float(os.environ.get('COBWEB_CACHE_SIZE', 256))*2**20,
+                       decimals=int(os.environ.get('COBWEB_CACHE_DECIMALS', 6)),
+                       version=version)
+
+
+
+def memoize(cache, namespace):
+    '''
+    Decorator that stores the return values of a function in cache, keyed
+    on namespace and the arguments. Returns the function unchanged if cache
+    is None.
+    '''
+
+    def decorator(func):
+        if cache is None:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            key = cache.key(namespace, *args)
+            data = cache.get(key)
+            if data is not None:
+                return pickle.loads(data)
+            result = func(*args)
+            cache.set(key, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+
+def cache_responses(app, cache, callbacks):
+    '''
+    Serve the responses of the named callbacks of a Dash app from cache,
+    and store the responses that are computed. Register after the metrics
+    hooks (instrument_app), so that hits are still timed.
+    '''
+
+    server = app.server
+
+    @server.before_request
+    def serve_cached():
+        if not request.path.endswith('/_dash-update-component'):
+            return None
+        body = request.get_json(silent=True) or {}
+        if callback_name(app, body.get('output')) not in callbacks:
+            return None
+        key = cache.key('response', body.get('output'),
+                        [item.get('value') for item in body.get('inputs', [])],
+                        [item.get('value') for item in body.get('state', [])],
+                        sorted(body.get('changedPropIds') or []))
+        data = cache.get(key)
+        if data is not None:
+            return Response(data, mimetype='application/json')
+        g.response_cache_key = key
+        return None
+
+    @server.after_request
+    def store_response(response):
+        key = g.pop('response_cache_key', None)
+        if key is not None and response.status_code == 200:
+            cache.set(key, response.get_data())
+        return response
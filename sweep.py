@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 17 Oct 2026
+
+Command line tool for large parameter sweeps of the sigmoid cobweb map.
+
+The sweep is over the Cartesian product of values given for each parameter.
+Parameter sets are split into chunks that are classified in parallel by a
+pool of processes using classify_dynamics_batch. Results are written to
+memory-mapped .npy files (one per output column) in the output directory,
+so sweeps can be larger than RAM. Finished chunks are recorded in done.npy
+and skipped if the sweep is run again, so an interrupted sweep can be resumed.
+
+Example (use = for values starting with a minus sign):
+    python sweep.py sweep_out --ts 100:500:401 --b 1:100:100 --theta=-20:20:41 --workers 8
+"""
+
+import os
+import json
+import time
+import argparse
+import multiprocessing
+
+import numpy as np
+
+from app_functions import classify_dynamics_batch
+
+
+
+# Parameters of the sweep (in the order of the axes of the output arrays)
+param_names = ['apd0', 'a', 'b', 'x0', 'theta', 'ts']
+
+# Default parameter values (as in app.py)
+param_defaults = {'apd0':150, 'a':201.3, 'b':46.6, 'x0':-13.5, 'theta':0, 'ts':300}
+
+# Output columns and their data types
+columns = {
+    'apd_final': np.float64,
+    'period': np.int16,
+    'lyapunov': np.float32,
+    'n_stim': np.int16,
+    }
+
+# Optional column with the last n_keep APD values of each parameter set
+tail_column = ('apd_tail', np.float32)
+
+
+def sweep_columns(meta):
+    '''
+    Names, data types and shapes of the output arrays of a sweep
+    '''
+    shape = tuple(meta['shape'])
+    out = [(name, dtype, shape) for name, dtype in columns.items()]
+    if meta['store_tail']:
+        out.append(tail_column + (shape + (meta['n_keep'],),))
+    return out
+
+
+
+def parse_axis(spec):
+    '''
+    Parse the values for one parameter, given either as a single value or
+    as start:stop:num for num equally spaced values (np.linspace).
+    '''
+    parts = spec.split(':')
+    if len(parts) == 1:
+        return [float(parts[0])]
+    if len(parts) == 3:
+        return np.linspace(float(parts[0]), float(parts[1]), int(parts[2])).tolist()
+    raise argparse.ArgumentTypeError(
+        'Expected a value or start:stop:num, got {}'.format(spec))
+
+
+
+def open_sweep(out_dir, meta, overwrite=False):
+    '''
+    Create the output files of a sweep, or open them to resume the sweep if
+    they exist and were made with the same settings.
+
+    Output:
+        results: dict of memory-mapped output arrays
+        done: memory-mapped boolean array of finished chunks
+    '''
+
+    path_meta = os.path.join(out_dir, 'meta.json')
+
+    resume = os.path.exists(path_meta) and not overwrite
+    if resume:
+        with open(path_meta) as f:
+            meta_old = json.load(f)
+        if meta_old != meta:
+            raise ValueError(
+                'Settings differ from the sweep in {}. Use a new output '
+                'directory or --overwrite.'.format(out_dir))
+        mode = 'r+'
+    else:
+        os.makedirs(out_dir, exist_ok=True)
+        mode = 'w+'
+
+    results = {}
+    for name, dtype, shape in sweep_columns(meta):
+        results[name] = np.lib.format.open_memmap(
+            os.path.join(out_dir, name+'.npy'), mode=mode, dtype=dtype, shape=shape)
+    done = np.lib.format.open_memmap(
+        os.path.join(out_dir, 'done.npy'), mode=mode, dtype=bool,
+        shape=(meta['n_chunks'],))
+
+    if not resume:
+        # Write metadata last so that a sweep is only resumed from complete files
+        done[:] = False
+        done.flush()
+        with open(path_meta, 'w') as f:
+            json.dump(meta, f, indent=1)
+
+    return results, done
+
+
+
+# Settings and output arrays of each worker process
+_worker = {}
+
+
+def _init_worker(out_dir, meta):
+    _worker['meta'] = meta
+    _worker['results'] = {
+        name: np.load(os.path.join(out_dir, name+'.npy'), mmap_mode='r+')
+        for name, dtype, shape in sweep_columns(meta)}
+
+
+
+def _run_chunk(chunk):
+    '''
+    Classify the parameter sets in one chunk and write them to the output
+    files. Runs in a worker process.
+    '''
+
+    meta = _worker['meta']
+    results = _worker['results']
+
+    n_total = int(np.prod(meta['shape']))
+    start = chunk*meta['chunk_size']
+    stop = min(start + meta['chunk_size'], n_total)
+
+    # Parameter values of each set in the chunk
+    idx = np.unravel_index(np.arange(start, stop), meta['shape'])
+    params = [np.asarray(meta['axes'][name])[i] for name, i in zip(param_names, idx)]
+
+    output = classify_dynamics_batch(
+        *params,
+        n_transient=meta['n_transient'],
+        n_keep=meta['n_keep'],
+        tol=meta['tol'],
+        max_period=meta['max_period'],
+        return_tail=meta['store_tail'],
+        )
+
+    for (name, dtype, shape), values in zip(sweep_columns(meta), output):
+        flat = results[name].reshape((n_total, -1))
+        flat[start:stop] = values.reshape((stop-start, -1))
+        results[name].flush()
+
+    return chunk
+
+
+
+def run_sweep(out_dir, axes, n_transient=500, n_keep=64, tol=1e-3,
+              max_period=16, chunk_size=100000, workers=None, overwrite=False,
+              store_tail=False):
+    '''
+    Run (or resume) a sweep over the Cartesian product of the parameter
+    values in axes (dict with a list of values for each of param_names).
+    If store_tail is True the last n_keep APD values of each parameter set
+    are also saved (in apd_tail.npy).
+    '''
+
+    shape = [len(axes[name]) for name in param_names]
+    n_total = int(np.prod(shape))
+    meta = {
+        'axes': {name: list(map(float, axes[name])) for name in param_names},
+        'shape': shape,
+        'n_transient': n_transient,
+        'n_keep': n_keep,
+        'tol': tol,
+        'max_period': max_period,
+        'store_tail': store_tail,
+        'chunk_size': chunk_size,
+        'n_chunks': -(-n_total//chunk_size),
+        }
+
+    results, done = open_sweep(out_dir, meta, overwrite=overwrite)
+    del results
+
+    chunks = np.flatnonzero(~done).tolist()
+    print('{} parameter sets in {} chunks, {} left to run'.format(
+        n_total, meta['n_chunks'], len(chunks)))
+
+    t0 = time.time()
+    with multiprocessing.Pool(workers, initializer=_init_worker,
+                              initargs=(out_dir, meta)) as pool:
+        for i, chunk in enumerate(pool.imap_unordered(_run_chunk, chunks)):
+            # Chunk is marked as done only once its results are written
+            done[chunk] = True
+            done.flush()
+            print('Chunk {} done ({}/{}, {:.1f} s)'.format(
+                chunk, i+1, len(chunks), time.time()-t0), flush=True)
+
+    return done.all()
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Parameter sweep of the sigmoid cobweb map')
+    parser.add_argument('out_dir', help='Output directory')
+    for name in param_names:
+        parser.add_argument('--'+name, type=parse_axis,
+                            default=[param_defaults[name]],
+                            help='Value or start:stop:num (default {})'.format(
+                                param_defaults[name]))
+    parser.add_argument('--n-transient', type=int, default=500,
+                        help='Number of iterations discarded as transient')
+    parser.add_argument('--n-keep', type=int, default=64,
+                        help='Number of iterations used to classify the dynamics')
+    parser.add_argument('--tol', type=float, default=1e-3,
+                        help='Tolerance (ms) for detecting the period')
+    parser.add_argument('--max-period', type=int, default=16,
+                        help='Largest period to detect')
+    parser.add_argument('--chunk-size', type=int, default=100000,
+                        help='Number of parameter sets per chunk')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of processes (default: number of cores)')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='Start again instead of resuming')
+    parser.add_argument('--store-tail', action='store_true',
+                        help='Also save the last n-keep APD values of each set')
+    args = parser.parse_args()
+
+    axes = {name: getattr(args, name) for name in param_names}
+    run_sweep(args.out_dir, axes,
+              n_transient=args.n_transient,
+              n_keep=args.n_keep,
+              tol=args.tol,
+              max_period=args.max_period,
+              chunk_size=args.chunk_size,
+              workers=args.workers,
+              overwrite=args.overwrite,
+              store_tail=args.store_tail,
+              )
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 17 Oct 2026
+
+Regression tests of the numerical functions in app_functions.py.
+
+Run from the repository root with
+    python -m pytest tests
+"""
+
+import numpy as np
+
+import app_functions as af
+
+
+
+def test_fixed_points_slow_newton():
+    # Newton steps stayed in the bracket but moved very little, and an
+    # unconverged value was returned as a stable fixed point
+    params = (246.0668, 4.1556, 42.686)
+    apd_fp, slope, stable = af.find_fixed_points_sigmoid(*params, 19.338, 277.50)
+    found = ~np.isnan(apd_fp)
+    assert found.sum() == 1
+    assert np.allclose(apd_fp[found], 224.97686, atol=1e-4)
+    assert np.allclose(slope[found], -4.6401, atol=1e-3)
+    assert not stable[found].any()
+    assert np.allclose(af.cobweb_map_sigmoid(apd_fp[found], *params, 19.338, 277.50),
+                       apd_fp[found], atol=1e-8)
+
+
+def test_fixed_points_are_fixed():
+    rng = np.random.default_rng(0)
+    n = 3000
+    a = rng.uniform(100, 300, n)
+    b = rng.uniform(1, 100, n)
+    x0 = rng.uniform(-50, 50, n)
+    theta = rng.uniform(-20, 20, n)
+    ts = rng.uniform(100, 500, n)
+    apd_fp, slope, stable = af.find_fixed_points_sigmoid(a, b, x0, theta, ts)
+    apd_next = af.cobweb_map_sigmoid(apd_fp, a[:,None], b[:,None], x0[:,None],
+                                     theta[:,None], ts[:,None])
+    assert np.nanmax(np.abs(apd_next - apd_fp)) < 1e-8
+
+
+def test_fixed_points_branch_1_negative_theta():
+    apd_fp, slope, stable = af.find_fixed_points(130, 200, 190, -20, 100)
+    assert np.isclose(apd_fp[0], 7.24928, atol=1e-4)
+    assert stable[0]
+
+
+def test_classify_slow_fixed_point():
+    # Fixed points with a slope close to -1 were classified as alternans
+    # (period 2) or no cycle after the transient
+    apd0 = np.linspace(0, 250, 11)
+    for b, ts in ((41.41, 170), (43.43, 160), (42, 165)):
+        apd_final, period, lyapunov, n_stim = af.classify_dynamics_batch_model(
+            af.sigmoid_model, apd0, (201.3, b, -13.5), 0, ts, n_keep=32)
+        assert np.all(period == 1)
+
+
+def test_classify_slow_alternans():
+    # Fixed point just unstable (slope -1.0005): a slowly converging 2:2
+    # alternans, not a fixed point or no cycle
+    apd_final, period, lyapunov, n_stim = af.classify_dynamics_batch_model(
+        af.sigmoid_model, 125, (201.3, 43, -13.5), 0, 160, n_keep=32)
+    assert period == 2
+    assert n_stim == 2
+
+
+def test_basins_slow_cycles():
+    # Slowly converging fixed points and 2-cycles near a period doubling
+    # were split into spurious attractors and no cycle
+    apd0 = np.linspace(0, 250, 10**5)
+    for b, ts, cycle in ((42, 165, [141.913]), (43, 160, [135.727, 142.218]),
+                         (30, 196, [160.29, 168.60])):
+        labels, attractors = af.compute_basins_model(
+            af.sigmoid_model, apd0, (201.3, b, -13.5), 0, ts)
+        assert len(attractors) == 2
+        assert all(len(c) > 0 for c in attractors)
+        assert any(len(c) == len(cycle) and np.allclose(c, cycle, atol=1e-2)
+                   for c in attractors)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 17 Oct 2026
+
+Precomputed store for the bifurcation diagram and regime map panels.
+
+The store is a sweep (see sweep.py) of the sigmoid map over a grid covering
+the slider ranges of a, b, x0, theta and ts at a fixed APD_0, saved with the
+asymptotic APD values of every parameter set. In this layout
+    - the bifurcation diagram for given (a, b, x0, theta) is one contiguous
+      tile apd_tail[0, i_a, i_b, i_x0, i_theta, :, :]
+    - the regime map over any two of the parameters is a 2D slice of the
+      period, lyapunov and n_stim arrays.
+The arrays are opened as read-only memory maps, so gunicorn workers share
+them through the OS page cache and only the pages of a requested tile are
+read from disk.
+
+A panel is only served when every fixed parameter is a grid point of the
+store (the grid values of a, b, x0 and theta are integers, as the slider
+steps) and the free axes of the store are those of the panel in the app.
+The app computes the panel otherwise. The store is built with
+panel_settings, which the app also uses when it computes a panel, so a
+panel does not depend on where it came from.
+
+Build the store with
+    python tile_store.py tiles
+and point the app at it with the environment variable COBWEB_TILES (the
+default is the directory 'tiles' next to app.py).
+"""
+
+import os
+import json
+import argparse
+
+import numpy as np
+
+from app_functions import bifurcation_points
+from sweep import param_names, param_defaults, parse_axis, run_sweep
+
+
+
+# Settings of the iteration for the store, also used by the app when it
+# computes the panels
+panel_settings = {'n_transient': 500, 'n_keep': 32, 'tol': 1e-3, 'max_period': 16}
+
+# Default grid of the store, on integer values (the slider steps). The ts
+# axis is that of the bifurcation diagram in app.py. The slider defaults in
+# app.py are added to each axis so that the initial view of the app is
+# served from the store.
+grid_defaults = {
+    'a': '100:300:11',
+    'b': '1:100:12',
+    'x0': '-50:50:11',
+    'theta': '-20:20:5',
+    'ts': '100:500:401',
+    }
+
+
+
+class TileStore:
+    '''
+    Read-only access to a precomputed store. Arrays are memory-mapped on
+    first use, so opening a store is cheap and can happen before or after
+    gunicorn forks its workers.
+
+    The lookups return None unless every fixed parameter is on the grid of
+    the store and the free axes are those asked for, in which case the
+    caller should compute the panel instead.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.axes = {name: np.asarray(vals) for name, vals in self.meta['axes'].items()}
+        self._arrays = {}
+
+
+    def array(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.path, name+'.npy'),
+                                         mmap_mode='r')
+        return self._arrays[name]
+
+
+    def complete(self):
+        return bool(np.all(self.array('done')))
+
+
+    def index(self, name, value):
+        '''
+        Index of value on the axis of parameter name, or None if it is not a
+        grid point of the store
+        '''
+        match = np.flatnonzero(np.isclose(self.axes[name], value, rtol=0, atol=1e-9))
+        return int(match[0]) if match.size else None
+
+
+    def has_axis(self, name, values):
+        '''
+        True if the axis of parameter name has exactly the given values
+        '''
+        axis = self.axes[name]
+        return len(axis) == len(values) and np.allclose(axis, values, rtol=0, atol=1e-9)
+
+
+    def _indices(self, params, free):
+        idx = []
+        for name in param_names:
+            if name in free:
+                idx.append(slice(None))
+            else:
+                i = self.index(name, params[name])
+                if i is None:
+                    return None
+                idx.append(i)
+        return tuple(idx)
+
+
+    def bifurcation(self, apd0, a, b, x0, theta, ts_vals, tol=0.05):
+        '''
+        Points of the bifurcation diagram over ts_vals, as returned by
+        compute_bifurcation_data, if ts_vals is the ts axis of the store
+        '''
+        if not self.has_axis('ts', ts_vals):
+            return None
+        params = dict(apd0=apd0, a=a, b=b, x0=x0, theta=theta)
+        idx = self._indices(params, free=('ts',))
+        if idx is None:
+            return None
+        apd_asym = np.asarray(self.array('apd_tail')[idx], dtype=float)
+        return bifurcation_points(self.axes['ts'], apd_asym, tol=tol)
+
+
+    def regime_map(self, x_name, x_vals, y_name, y_vals, params):
+        '''
+        Regime map over x_vals and y_name of parameters x_name and y_name,
+        as returned by compute_regime_map (with the axis values), if these
+        are axes of the store
+        '''
+        if x_name == y_name or x_name not in self.axes or y_name not in self.axes:
+            return None
+        if not (self.has_axis(x_name, x_vals) and self.has_axis(y_name, y_vals)):
+            return None
+        idx = self._indices(params, free=(x_name, y_name))
+        if idx is None:
+            return None
+
+        # Slices have the axes in the order of param_names
+        transpose = param_names.index(x_name) < param_names.index(y_name)
+        out = []
+        for name in ('period', 'lyapunov', 'n_stim'):
+            arr = np.asarray(self.array(name)[idx])
+            out.append(arr.T if transpose else arr)
+
+        return (self.axes[x_name], self.axes[y_name]) + tuple(out)
+
+
+
+def open_tile_store(path):
+    '''
+    Open the store at path, or return None if there is no complete store
+    built with panel_settings
+    '''
+    try:
+        store = TileStore(path)
+    except FileNotFoundError:
+        return None
+    if not store.complete():
+        return None
+    if any(store.meta.get(k) != v for k, v in panel_settings.items()):
+        print('Tile store in {} was built with other settings, not using it'.format(path))
+        return None
+    return store
+
+
+
+def build_tile_store(out_dir, grid, **kwargs):
+    '''
+    Compute the store over the grid (dict of start:stop:num strings or
+    single values for apd0, a, b, x0, theta and ts) with panel_settings.
+    kwargs are passed to run_sweep.
+    '''
+
+    axes = {}
+    for name in param_names:
+        vals = parse_axis(str(grid.get(name, param_defaults[name]))) + [param_defaults[name]]
+        axes[name] = np.unique(np.round(vals, 9)).tolist()
+
+    return run_sweep(out_dir, axes, store_tail=True, **panel_settings, **kwargs)
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Build the precomputed store for the bifurcation and regime map panels')
+    parser.add_argument('out_dir', help='Output directory')
+    for name, spec in grid_defaults.items():
+        parser.add_argument('--'+name, default=spec,
+                            help='Grid as start:stop:num (default {})'.format(spec))
+    parser.add_argument('--apd0', default=str(param_defaults['apd0']),
+                        help='Initial condition, or grid as start:stop:num (each '
+                             'value multiplies the size of the store)')
+    parser.add_argument('--chunk-size', type=int, default=100000,
+                        help='Number of parameter sets per chunk')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of processes (default: number of cores)')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='Start again instead of resuming')
+    args = parser.parse_args()
+
+    grid = dict({name: getattr(args, name) for name in grid_defaults}, apd0=args.apd0)
+    build_tile_store(args.out_dir, grid,
+                     chunk_size=args.chunk_size,
+                     workers=args.workers,
+                     overwrite=args.overwrite,
+                     )